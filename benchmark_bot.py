@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FortyTwo Bot 离线压测 - 在本地启动模拟的Monad JSON-RPC节点、BlockVision接口和Telegram Bot API，
+用合成用户和地址把命令作为Update放进真实Application的更新队列（与 main() 相同的并发设置），输出命令延迟p50/p99、上游调用次数和内存占用
+
+示例：
+    python benchmark_bot.py --users 50 --addresses 20 --rounds 3
+    python benchmark_bot.py --rpc-429 0.05 --bv-errors 0.2 --save baseline.json
+    python benchmark_bot.py --baseline baseline.json  # p99或上游调用次数退化超过阈值时退出码为1
+
+机器人自身的配置（RPC_RATE_LIMIT、TELEGRAM_GLOBAL_RATE 等）照常通过环境变量设置。
+"""
+
+import os
+import sys
+import abc
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import importlib
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs, parse_qsl
+from eth_abi import encode, decode
+from web3 import Web3
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import HTTPXRequest
+
+START_BLOCK = 1_000_000
+BLOCKS_PER_SECOND = 2  # 模拟节点的出块速度
+FAKE_BOT_TOKEN = "123456:BENCHMARK"
+REGRESSION_FLOOR_MS = 5  # p99 增长小于该值时视为测量噪声
+
+def selector(signature):
+    return bytes(Web3.keccak(text=signature)[:4])
+
+AGGREGATE3 = selector("aggregate3((address,bool,bytes)[])")
+GET_ETH_BALANCE = selector("getEthBalance(address)")
+GET_BLOCK_NUMBER = selector("getBlockNumber()")
+BALANCE_OF = selector("balanceOf(address)")
+SYMBOL = selector("symbol()")
+DECIMALS = selector("decimals()")
+
+class FakeUpstream(abc.ABC):
+    """本地模拟的上游HTTP服务（支持长连接），按配置注入延迟、5xx错误和429限流"""
+
+    name = "upstream"
+
+    def __init__(self, latency, jitter, error_rate, rate_limit_rate, rng):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = rng
+        self.calls = Counter()  # 按接口统计的请求次数
+        self.injected = Counter()  # 注入的 429 / 5xx 次数
+        self.server = None
+        self.port = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                method, target = request_line.decode("latin-1").split()[:2]
+                status, payload = await self.respond(method, target, headers, body)
+                data = json.dumps(payload).encode()
+                extra = "Retry-After: 1\r\n" if status == 429 else ""
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n{extra}\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, headers, body):
+        url = urlsplit(target)
+        # 对数正态分布的延迟：中位数为 latency，jitter 越大长尾越明显
+        await asyncio.sleep(self.latency * self.rng.lognormvariate(0, self.jitter) if self.latency else 0)
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.injected["429"] += 1
+            return 429, self.rate_limited(url)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.injected["5xx"] += 1
+            return 502, self.failed(url)
+        return 200, self.handle(url, headers, body)
+
+    def rate_limited(self, url):
+        return {"error": "Too Many Requests"}
+
+    def failed(self, url):
+        return {"error": "Bad Gateway"}
+
+    @abc.abstractmethod
+    def handle(self, url, headers, body):
+        """返回正常响应的JSON内容"""
+
+class FakeRpcNode(FakeUpstream):
+    """模拟Monad JSON-RPC节点：支持批量请求和Multicall3 aggregate3，余额随区块缓慢变化"""
+
+    name = "rpc"
+
+    def __init__(self, *args, token, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token = token.lower()
+        self.started = time.monotonic()
+        self.batch_items = 0
+        self.multicall_reads = 0
+
+    def block_number(self):
+        return START_BLOCK + int((time.monotonic() - self.started) * BLOCKS_PER_SECOND)
+
+    def balance(self, address, asset, block):
+        """地址的确定性余额；约四分之一的地址每20个区块增加一次，用于触发余额变化"""
+        seed = int(address[-8:], 16)
+        base = (seed % 1000 + 1) * 10**17 if asset == "native" else (seed % 5000 + 1) * 10**16
+        if seed % 4 == 0:
+            base += (block // 20) % 1000 * 10**15
+        return base
+
+    def rate_limited(self, url):
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": 429, "message": "Too Many Requests"}}
+
+    def failed(self, url):
+        return {"jsonrpc": "2.0", "id": None, "error": {"code": -32603, "message": "upstream unavailable"}}
+
+    def handle(self, url, headers, body):
+        request = json.loads(body)
+        if isinstance(request, list):
+            self.calls["batch"] += 1
+            self.batch_items += len(request)
+            return [self.call(item) for item in request]
+        return self.call(request)
+
+    def call(self, request):
+        method = request["method"]
+        params = request.get("params", [])
+        self.calls[method] += 1
+        block = self.block_number()
+        if method == "eth_blockNumber":
+            result = hex(block)
+        elif method == "eth_getBalance":
+            result = hex(self.balance(params[0], "native", block))
+        elif method == "eth_call":
+            data = bytes.fromhex(params[0]["data"][2:])
+            if data[:4] == AGGREGATE3:
+                (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+                self.multicall_reads += len(calls)
+                returned = [self.evaluate(target, call_data, block) for target, _, call_data in calls]
+                result = "0x" + encode(["(bool,bytes)[]"], [returned]).hex()
+            else:
+                success, output = self.evaluate(params[0]["to"], data, block)
+                if not success:
+                    return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": 3, "message": "execution reverted"}}
+                result = "0x" + output.hex()
+        elif method == "eth_getLogs":
+            result = []
+        elif method == "eth_getBlockByNumber":
+            number = int(params[0], 16) if params[0] != "latest" else block
+            result = {"number": hex(number), "timestamp": hex(1_700_000_000 + number), "transactions": []}
+        else:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": "method not found"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def evaluate(self, target, data, block):
+        """执行一次模拟的合约调用，返回 (成功, 返回数据)"""
+        function = data[:4]
+        if function == GET_BLOCK_NUMBER:
+            return True, encode(["uint256"], [block])
+        if function == GET_ETH_BALANCE:
+            return True, encode(["uint256"], [self.balance(decode(["address"], data[4:])[0], "native", block)])
+        if function == BALANCE_OF:
+            return True, encode(["uint256"], [self.balance(decode(["address"], data[4:])[0], target.lower(), block)])
+        if function == SYMBOL:
+            return True, encode(["string"], ["42T" if target.lower() == self.token else "TKN"])
+        if function == DECIMALS:
+            return True, encode(["uint8"], [18])
+        return False, b""
+
+class FakeActivityApi(FakeUpstream):
+    """模拟BlockVision账户活动接口和区块浏览器的交易列表接口"""
+
+    name = "activity"
+
+    BLOCKVISION_PATH = "/v2/monad/account/activities"
+
+    def handle(self, url, headers, body):
+        query = parse_qs(url.query)
+        if url.path == self.BLOCKVISION_PATH:
+            self.calls["blockvision"] += 1
+            address = query["address"][0]
+            limit = int(query.get("limit", ["3"])[0])
+            return {"code": 0, "result": {"data": [self.activity(address, i) for i in range(limit)]}}
+        self.calls["explorer"] += 1
+        address = (query.get("address") or [url.path.split("/")[-2]])[0]
+        return {"transactions": [
+            {"hash": self.tx_hash(address, i), "timestamp": int(time.time()) - 60 * i} for i in range(3)
+        ]}
+
+    def tx_hash(self, address, index):
+        return "0x" + Web3.keccak(text=f"{address.lower()}:{index}").hex().removeprefix("0x")
+
+    def activity(self, address, index):
+        return {
+            "hash": self.tx_hash(address, index),
+            "timestamp": int(time.time() * 1000) - 60_000 * index,
+            "txStatus": 1,
+            "txName": "Transfer",
+            "transactionFee": "0.0001",
+            "addTokens": [{"symbol": "42T", "amount": "1"}]
+        }
+
+class FakeTelegramApi(FakeUpstream):
+    """模拟Telegram Bot API：getMe、sendMessage 和 editMessageText"""
+
+    name = "telegram"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.next_message_id = 1
+
+    def rate_limited(self, url):
+        return {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}}
+
+    def failed(self, url):
+        return {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+
+    def handle(self, url, headers, body):
+        method = url.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        if "json" in headers.get("content-type", ""):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode()))
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}}
+        if method not in ("sendMessage", "editMessageText"):
+            return {"ok": True, "result": True}
+        chat_id = int(params.get("chat_id", 0))
+        if method == "sendMessage":
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        else:
+            message_id = int(params.get("message_id", 0))
+        return {"ok": True, "result": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", "")
+        }}
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class Benchmark:
+    """按轮次驱动合成用户：命令包装成Update经过 Application 的更新队列分发，记录从入队到处理完毕的延迟"""
+
+    def __init__(self, bot, application, args, rpc, rng):
+        self.bot = bot
+        self.application = application
+        self.args = args
+        self.rpc = rpc
+        self.rng = rng
+        self.latencies = {}  # 命令 -> 每次耗时（秒）
+        self.errors = Counter()
+        self.users = {}  # user_id -> 地址列表
+        self.update_id = 0
+        self.pending = {}  # update_id -> 处理完毕时完成的Future
+        # 命令处理函数在第0组，之后的组在它结束（或出错）后才执行
+        application.add_handler(TypeHandler(Update, self.finished), group=1)
+        application.add_error_handler(self.failed)
+
+    async def finished(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def failed(self, update, context):
+        future = self.pending.pop(getattr(update, "update_id", None), None)
+        if future is not None and not future.done():
+            future.set_exception(context.error)
+
+    async def dispatch(self, user_id, text):
+        """把命令文本包装成私聊消息放进更新队列，等待处理函数执行完毕"""
+        self.update_id += 1
+        uid = int(user_id)
+        command = text.split()[0]
+        update = Update.de_json({
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]
+            }
+        }, self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update.update_id] = future
+        await self.application.update_queue.put(update)
+        await future
+
+    def setup_users(self):
+        """生成地址池，每个用户从池中抽取地址，用户之间部分重叠以体现缓存效果"""
+        pool_size = max(self.args.addresses, int(self.args.users * self.args.addresses * (1 - self.args.overlap)))
+        pool = [Web3.to_checksum_address(f"0x{self.rng.getrandbits(160):040x}") for _ in range(pool_size)]
+        for index in range(self.args.users):
+            user_id = str(1000 + index)
+            addresses = self.rng.sample(pool, self.args.addresses)
+            self.bot.add_user_addresses(user_id, addresses)
+            self.users[user_id] = addresses
+        return pool
+
+    async def timed(self, name, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors[name] += 1
+            if self.errors[name] == 1:
+                print(f"{name} failed: {type(e).__name__}: {e}")
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    async def run_user(self, user_id, semaphore):
+        async with semaphore:
+            addresses = self.users[user_id]
+            address = self.rng.choice(addresses)
+            await self.timed("/check", self.dispatch(user_id, "/check"))
+            await self.timed("/check_address", self.dispatch(user_id, f"/check_address {address}"))
+            await self.timed("/summary", self.dispatch(user_id, "/summary 24h"))
+            await self.timed("get_recent_transactions", self.bot.get_recent_transactions(address))
+            block = self.rpc.block_number()
+            started = time.perf_counter()
+            for item in addresses:
+                self.bot.get_balance_change(item, self.rpc.balance(item, "native", block), self.rpc.balance(item, self.rpc.token, block))
+            self.latencies.setdefault("get_balance_change", []).append((time.perf_counter() - started) / len(addresses))
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        for round_index in range(self.args.rounds):
+            started = time.perf_counter()
+            await asyncio.gather(*(self.run_user(user_id, semaphore) for user_id in self.users))
+            print(f"round {round_index + 1}/{self.args.rounds}: {time.perf_counter() - started:.2f}s")
+            if round_index + 1 < self.args.rounds:
+                # 轮次之间模拟一次后台快照刷新
+                await self.timed("refresh_snapshots_job", self.bot.refresh_snapshots_job(None))
+
+async def drain_outbox(outbox, timeout=60):
+    deadline = time.monotonic() + timeout
+    while (outbox.depth() or outbox.busy) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+def upstream_counts(rpc, activity, telegram):
+    return {
+        "rpc": dict(rpc.calls),
+        "rpc_batch_items": rpc.batch_items,
+        "rpc_multicall_reads": rpc.multicall_reads,
+        "activity": dict(activity.calls),
+        "telegram": dict(telegram.calls),
+        "injected": {upstream.name: dict(upstream.injected) for upstream in (rpc, activity, telegram)}
+    }
+
+def print_report(result):
+    print()
+    print(f"{'command':<26}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in result["commands"].items():
+        print(f"{name:<26}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+
+    upstream = result["upstream"]
+    print()
+    print("upstream calls:")
+    print(f"  rpc       {sum(upstream['rpc'].values())} HTTP requests {upstream['rpc']}")
+    print(f"            {upstream['rpc_batch_items']} batched items, {upstream['rpc_multicall_reads']} multicall reads")
+    print(f"  activity  {upstream['activity']}")
+    print(f"  telegram  {upstream['telegram']}")
+    print(f"  injected  {upstream['injected']} (not included in the counts above)")
+
+    outbox = result.get("outbox")
+    if outbox:
+        print()
+        print(f"outbox: {outbox['sent']} sent, {outbox['merged']} merged, {outbox['retry_after']} retry-after, "
+              f"queue wait p50 {outbox['p50_ms']} ms, p99 {outbox['p99_ms']} ms "
+              f"(chat interval {result['config']['chat_interval']:g}s, included in command latency)")
+
+    memory = result["memory"]
+    print()
+    print(f"memory: traced current {memory['current_kb']:.0f} KiB, peak {memory['peak_kb']:.0f} KiB")
+    for line in memory["top"]:
+        print(f"  {line}")
+
+def compare_baseline(result, baseline, tolerance):
+    """对比基线：任一命令p99或上游成功请求总数增长超过 tolerance 视为退化"""
+    regressions = []
+    for name, row in result["commands"].items():
+        before = baseline.get("commands", {}).get(name)
+        if before and before["p99_ms"] > 0 and row["p99_ms"] > before["p99_ms"] * (1 + tolerance) + REGRESSION_FLOOR_MS:
+            regressions.append(f"{name} p99 {before['p99_ms']:.1f}ms -> {row['p99_ms']:.1f}ms")
+    for upstream in ("rpc", "activity", "telegram"):
+        before = sum(baseline.get("upstream", {}).get(upstream, {}).values())
+        after = sum(result["upstream"][upstream].values())
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{upstream} calls {before} -> {after}")
+    return regressions
+
+async def run_benchmark(args):
+    """在临时目录中运行压测，结束后恢复工作目录并删除数据库等临时文件"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="fortytwo-bench-") as workdir:
+        try:
+            return await run_in_workdir(args, workdir)
+        finally:
+            os.chdir(cwd)
+
+async def run_in_workdir(args, workdir):
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    rpc = FakeRpcNode(args.rpc_latency, args.rpc_jitter, args.rpc_errors, args.rpc_429, random.Random(rng.random()),
+                      token="0x0000000000000000000000000000000000000000")
+    activity = FakeActivityApi(args.bv_latency, args.bv_jitter, args.bv_errors, args.bv_429, random.Random(rng.random()))
+    telegram = FakeTelegramApi(args.tg_latency, args.tg_jitter, args.tg_errors, args.tg_429, random.Random(rng.random()))
+    for upstream in (rpc, activity, telegram):
+        await upstream.start()
+
+    # 机器人在导入时读取配置，先把上游地址指向本地模拟服务，数据库放到临时目录
+    os.environ["MONAD_RPC_URLS"] = rpc.url
+    os.environ["BLOCKVISION_API_URL"] = activity.url + FakeActivityApi.BLOCKVISION_PATH
+    os.environ["EXPLORER_URL"] = activity.url
+    os.environ["DB_FILE"] = os.path.join(workdir, "benchmark.db")
+    os.environ["METRICS_PORT"] = "0"
+    # 同一聊天的发送间隔会计入命令延迟，显式设置以免继承部署环境的值
+    os.environ["TELEGRAM_CHAT_INTERVAL"] = str(args.chat_interval)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    bot = importlib.import_module("fortytwo_telegram_bot")
+    rpc.token = bot.FORTYTWO_TOKEN_ADDRESS.lower()
+
+    # 与 main() 使用相同的构建参数（并发处理更新），只把Bot API指向本地模拟服务，更新由压测直接放入队列
+    application = bot.build_application(
+        FAKE_BOT_TOKEN,
+        base_url=telegram.url + "/bot",
+        request=HTTPXRequest(connection_pool_size=256),
+        updater=None
+    )
+    bot.init_storage(os.environ["DB_FILE"])
+    bot.load_user_configs()
+    await application.initialize()
+    await application.start()
+    await bot.init_clients(application)
+
+    benchmark = Benchmark(bot, application, args, rpc, rng)
+    pool = benchmark.setup_users()
+    print(f"{args.users} users x {args.addresses} addresses ({len(pool)} distinct), {args.rounds} rounds, concurrency {args.concurrency}")
+    try:
+        await benchmark.run()
+        await drain_outbox(bot.OUTBOX)
+    finally:
+        outbox = bot.OUTBOX.stats()
+        current, peak = tracemalloc.get_traced_memory()
+        top = [
+            str(stat) for stat in tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(True, bot.__file__)]
+            ).statistics("lineno")[:5]
+        ]
+        tracemalloc.stop()
+        await application.stop()
+        await bot.close_clients(application)
+        bot.close_storage()
+        await application.shutdown()
+        for upstream in (rpc, activity, telegram):
+            await upstream.stop()
+
+    commands = {}
+    for name, values in benchmark.latencies.items():
+        commands[name] = {
+            "count": len(values),
+            "errors": benchmark.errors[name],
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": max(values) * 1000
+        }
+    return {
+        "config": vars(args),
+        "commands": commands,
+        "upstream": upstream_counts(rpc, activity, telegram),
+        "outbox": outbox,
+        "memory": {"current_kb": current / 1024, "peak_kb": peak / 1024, "top": top}
+    }
+
+def add_upstream_args(parser, prefix, title, latency, jitter=0.5):
+    group = parser.add_argument_group(title)
+    group.add_argument(f"--{prefix}-latency", type=float, default=latency, help=f"中位延迟（秒），默认 {latency}")
+    group.add_argument(f"--{prefix}-jitter", type=float, default=jitter, help=f"对数正态延迟的离散程度，默认 {jitter}")
+    group.add_argument(f"--{prefix}-errors", type=float, default=0.0, help="返回5xx的比例")
+    group.add_argument(f"--{prefix}-429", type=float, default=0.0, help="返回429限流的比例")
+
+def main():
+    parser = argparse.ArgumentParser(description="FortyTwo Bot 离线压测")
+    parser.add_argument("--users", type=int, default=20, help="合成用户数量")
+    parser.add_argument("--addresses", type=int, default=10, help="每个用户监控的地址数量")
+    parser.add_argument("--overlap", type=float, default=0.5, help="用户之间地址的重叠程度（0-1）")
+    parser.add_argument("--rounds", type=int, default=3, help="每个用户执行命令的轮数，第一轮为冷缓存")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时执行命令的用户数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--save", help="把结果保存为JSON文件")
+    parser.add_argument("--baseline", help="与之前保存的JSON结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例，默认 0.2")
+    parser.add_argument("--chat-interval", type=float, default=0.0,
+                        help="同一聊天两条消息的最小间隔（秒），即机器人的 TELEGRAM_CHAT_INTERVAL，默认 0 只测量处理延迟")
+    add_upstream_args(parser, "rpc", "JSON-RPC节点", 0.05)
+    add_upstream_args(parser, "bv", "BlockVision / 浏览器接口", 0.2)
+    add_upstream_args(parser, "tg", "Telegram Bot API", 0.03)
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    save_path = os.path.abspath(args.save) if args.save else None
+
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    if save_path:
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nresults saved to {save_path}")
+    if baseline is not None:
+        regressions = compare_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("\nregressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nno regressions against baseline")
+
+if __name__ == "__main__":
+    main()
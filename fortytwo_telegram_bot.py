@@ -6,77 +6,1632 @@ FortyTwo Token Telegram Bot - 通过Telegram机器人查询代币数量
 
 import os
 import json
-import requests
+import time
+import re
+import sys
+import html
+import sqlite3
+import asyncio
+import heapq
+import hmac
+import signal
+import functools
+import subprocess
+import threading
+import abc
+import httpx
+from collections import Counter, OrderedDict, deque
+from eth_abi import encode, decode
 from web3 import Web3
-from datetime import datetime
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from decimal import Decimal, localcontext
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
 
 # Constants
 MONAD_RPC = "https://testnet-rpc.monad.xyz"
+MONAD_RPC_URLS = [url.strip() for url in os.getenv("MONAD_RPC_URLS", MONAD_RPC).split(",") if url.strip()]  # 可配置多个RPC节点，逗号分隔
 FORTYTWO_TOKEN_ADDRESS = "0x22A3d96424Df6f04d02477cB5ba571BBf615F47E"  # 42T代币合约地址
 
 # BlockVision API配置
 BLOCKVISION_API_KEY = os.getenv("BLOCKVISION_API_KEY", "")  # 可选：BlockVision API密钥
+BLOCKVISION_API_URL = os.getenv("BLOCKVISION_API_URL", "https://api.blockvision.org/v2/monad/account/activities")
+EXPLORER_URL = os.getenv("EXPLORER_URL", "https://testnet.monadexplorer.com")  # 区块浏览器地址
+
+# 交易记录数据源配置
+BLOCKVISION_TIMEOUT = float(os.getenv("BLOCKVISION_TIMEOUT", "15"))  # BlockVision请求时限（秒）
+EXPLORER_TIMEOUT = float(os.getenv("EXPLORER_TIMEOUT", "10"))  # 浏览器API请求时限（秒）
+ACTIVITY_BREAKER_THRESHOLD = int(os.getenv("ACTIVITY_BREAKER_THRESHOLD", "3"))  # 连续失败多少次后熔断数据源
+ACTIVITY_BREAKER_COOLDOWN = float(os.getenv("ACTIVITY_BREAKER_COOLDOWN", "300"))  # 熔断持续时间（秒）
+
+# 存储配置
+DB_FILE = os.getenv("DB_FILE", "fortytwo_bot.db")  # SQLite数据库文件
+BALANCE_FLUSH_INTERVAL = float(os.getenv("BALANCE_FLUSH_INTERVAL", "30"))  # 余额快照批量写入间隔（秒）
+
+# 余额时间序列配置：(采样间隔秒数, 保留秒数)，间隔为0表示原始采样
+HISTORY_TIERS = (
+    (0, int(os.getenv("HISTORY_RAW_RETENTION", str(2 * 86400)))),
+    (300, int(os.getenv("HISTORY_5M_RETENTION", str(14 * 86400)))),
+    (3600, int(os.getenv("HISTORY_1H_RETENTION", str(180 * 86400)))),
+    (86400, int(os.getenv("HISTORY_1D_RETENTION", str(5 * 365 * 86400))))
+)
+HISTORY_POINTS = int(os.getenv("HISTORY_POINTS", "12"))  # /history 降采样后显示的点数
+SUMMARY_TOP_MOVERS = int(os.getenv("SUMMARY_TOP_MOVERS", "5"))  # /summary 列出的涨跌最多的地址数量
+SQLITE_BATCH_SIZE = 500  # 单条SQL语句中IN参数的数量上限
+
+# 并发查询配置
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))  # 同时查询的地址数量上限
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))  # 单个HTTP请求超时（秒）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))  # 连接池最大连接数
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))  # 连接池保持的空闲长连接数
+
+# RPC路由配置
+RPC_CALL_DEADLINE = float(os.getenv("RPC_CALL_DEADLINE", "20"))  # 单次RPC调用（含重试和对冲）的总时限（秒）
+RPC_HEDGE_PERCENTILE = float(os.getenv("RPC_HEDGE_PERCENTILE", "0.9"))  # 超过该延迟分位数仍未返回时发送对冲请求
+RPC_HEDGE_MIN_DELAY = float(os.getenv("RPC_HEDGE_MIN_DELAY", "0.3"))  # 对冲请求的最小等待时间（秒）
+RPC_RATE_LIMIT = float(os.getenv("RPC_RATE_LIMIT", "20"))  # 每个节点每秒请求数上限（令牌桶）
+RPC_EWMA_ALPHA = 0.2  # 延迟和错误率的指数平滑系数
+
+# 缓存配置
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "15"))  # 余额缓存有效期（秒）
+ACTIVITY_CACHE_TTL = float(os.getenv("ACTIVITY_CACHE_TTL", "60"))  # 交易记录缓存有效期（秒）
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "5000"))  # 每个缓存最多保存的地址数量
+
+# 批量导入配置
+BULK_IMPORT_LIMIT = int(os.getenv("BULK_IMPORT_LIMIT", "1000"))  # 单次导入的地址数量上限
+BULK_IMPORT_MAX_FILE_SIZE = 1024 * 1024  # 导入文件大小上限（字节）
+
+# 监控指标和性能分析配置
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Prometheus指标端口监听地址
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus指标端口，0 表示不启动
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}  # 可以使用 /stats 和 /profile 的用户ID
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))  # 采样分析器的采样间隔（秒）
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))  # 采样分析器自动停止的时长（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))  # 延迟直方图分桶上界（秒）
+
+# 运行模式和多进程配置
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()  # polling 或 webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Telegram推送更新的公网HTTPS地址，例如 https://bot.example.com/telegram
+WEBHOOK_PATH = urlsplit(WEBHOOK_URL).path or "/"
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")  # 本地监听地址，由反向代理转发HTTPS请求
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))  # 本地监听端口，所有工作进程共用
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # 可选：校验 X-Telegram-Bot-Api-Secret-Token 请求头
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # Telegram同时推送更新的最大连接数
+WEBHOOK_MAX_BODY = 1024 * 1024  # 单个更新请求体的大小上限（字节）
+BOT_WORKERS = max(1, int(os.getenv("BOT_WORKERS", "1")))  # webhook模式的工作进程数量
+WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "0"))  # 当前工作进程的序号，由主进程设置
+WORKER_COUNT = BOT_WORKERS if BOT_MODE == "webhook" else 1
+WORKER_RESTART_DELAY = 5  # 工作进程退出后至少间隔多久再重启（秒）
+SHARED_STATE = WORKER_COUNT > 1  # 多进程时以数据库为准，进程内的全局变量只作缓存
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))  # 同时处理的更新数量，一个用户的 /check 等待上游时不阻塞其他用户
+
+# 余额变化推送配置
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "60"))  # 后台检查余额变化的间隔（秒）
+
+# 报告快照配置
+SNAPSHOT_TICK_INTERVAL = float(os.getenv("SNAPSHOT_TICK_INTERVAL", "5"))  # 快照刷新任务的检查间隔（秒）
+SNAPSHOT_MIN_REFRESH = float(os.getenv("SNAPSHOT_MIN_REFRESH", "15"))  # 最近被查看或有变化的地址的刷新间隔（秒）
+SNAPSHOT_MAX_REFRESH = float(os.getenv("SNAPSHOT_MAX_REFRESH", "600"))  # 长期无人查看且无变化的地址的刷新间隔（秒）
+SNAPSHOT_IDLE_FACTOR = 0.25  # 刷新间隔 = 空闲时长 × 系数，限制在上下限之间
+SNAPSHOT_ACTIVE_WINDOW = float(os.getenv("SNAPSHOT_ACTIVE_WINDOW", "900"))  # 余额变化指示在报告中保留的时长（秒）
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "1800"))  # 超过该时长的快照在 /check 时改为实时查询（秒）
+
+# 报告发送配置
+REPORT_PAGE_LIMIT = 3900  # 每页最大字符数，低于Telegram的4096上限，为页头变化留出余量
+REPORT_EDIT_INTERVAL = float(os.getenv("REPORT_EDIT_INTERVAL", "1.5"))  # 报告中间进度两次编辑的最小间隔（秒），不足间隔的进度更新直接跳过
+REPORT_SEPARATOR = f"\n\n{'─' * 50}\n\n"  # 报告中地址之间的分隔线
+
+# Telegram发送队列配置
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # 全局每秒发送消息数上限
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1"))  # 同一聊天两条消息的最小间隔（秒）
+TELEGRAM_MESSAGE_LIMIT = 4096  # Telegram单条消息最大字符数
+
+# 区块索引器配置
+INDEXER_ENABLED = os.getenv("INDEXER_ENABLED", "1") == "1"  # 是否启用后台区块索引器
+INDEXER_INTERVAL = float(os.getenv("INDEXER_INTERVAL", "5"))  # 索引器轮询新区块的间隔（秒）
+INDEXER_MAX_BLOCKS_PER_TICK = int(os.getenv("INDEXER_MAX_BLOCKS_PER_TICK", "50"))  # 每次最多处理的区块数
+INDEXER_BATCH_SIZE = int(os.getenv("INDEXER_BATCH_SIZE", "10"))  # 每个JSON-RPC批量请求包含的区块数
+INDEXER_BACKFILL_BLOCKS = int(os.getenv("INDEXER_BACKFILL_BLOCKS", "100"))  # 首次启动时回溯的区块数
+INDEXER_TXS_PER_ADDRESS = int(os.getenv("INDEXER_TXS_PER_ADDRESS", "20"))  # 每个地址保留的交易条数
+TX_INDEX_FILE = "tx_index.json"  # 旧版索引文件，仅用于迁移
+
+# 42T Transfer日志查询配置
+LOGS_CHUNK_SIZE = int(os.getenv("LOGS_CHUNK_SIZE", "1000"))  # 每次eth_getLogs查询的初始区块范围
+LOGS_MIN_CHUNK_SIZE = int(os.getenv("LOGS_MIN_CHUNK_SIZE", "10"))  # 区块范围缩小的下限
+LOGS_CONCURRENCY = int(os.getenv("LOGS_CONCURRENCY", "4"))  # 并行的eth_getLogs请求数
+LOGS_ADDRESS_BATCH = int(os.getenv("LOGS_ADDRESS_BATCH", "100"))  # 每次查询作为topic过滤的地址数量
+LOGS_LOOKBACK_BLOCKS = int(os.getenv("LOGS_LOOKBACK_BLOCKS", "10000"))  # 新地址回溯42T转账的区块数
+
+# Multicall3配置（批量读取余额）
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+MULTICALL_BATCH_SIZE = int(os.getenv("MULTICALL_BATCH_SIZE", "400"))  # 每次aggregate3调用包含的余额读取数量（地址×资产）
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "50"))  # Multicall3不可用时，每个JSON-RPC批量请求包含的余额读取数量（公共节点限制批量大小）
+
+# 多代币监控配置
+TOKEN_WATCH_LIMIT = int(os.getenv("TOKEN_WATCH_LIMIT", "20"))  # 每个用户最多额外监控的代币数量
+NATIVE_ASSET = "native"  # 余额读取计划中表示原生MON，ERC20代币用小写合约地址表示
+T42_ASSET = FORTYTWO_TOKEN_ADDRESS.lower()
+
+def function_selector(signature):
+    """计算合约函数选择器"""
+    return bytes(Web3.keccak(text=signature)[:4])
+
+ERC20_BALANCE_OF_SELECTOR = function_selector("balanceOf(address)")
+AGGREGATE3_SELECTOR = function_selector("aggregate3((address,bool,bytes)[])")
+GET_ETH_BALANCE_SELECTOR = function_selector("getEthBalance(address)")
+GET_BLOCK_NUMBER_SELECTOR = function_selector("getBlockNumber()")
+ERC20_SYMBOL_SELECTOR = function_selector("symbol()")
+ERC20_DECIMALS_SELECTOR = function_selector("decimals()")
+TRANSFER_TOPIC = "0x" + bytes(Web3.keccak(text="Transfer(address,address,uint256)")).hex()
 
 DEFAULT_ADDRESSES = [
 
 ]
 
 USER_CONFIGS = {}
+USER_ADDRESS_INDEX = {}  # 用户ID -> 小写地址集合，用于O(1)去重
 BALANCE_HISTORY = {}  # 存储余额历史记录
+TX_INDEX = {"last_block": None, "addresses": {}, "backfilled": []}  # 区块索引器记录的交易：小写地址 -> 最新在前的交易列表
+DB = None  # SQLite连接，由 init_storage 创建
+DIRTY_SNAPSHOTS = set()  # 等待批量写入的余额快照地址
+DIRTY_TX_INDEX = set()  # 等待写入的索引地址
+SERIES_LAST = {}  # 每个 (地址, 层级) 最后一条记录：(时间桶, 区块号, MON wei, 42T wei)
+SERIES_PENDING = {}  # 等待批量写入的时间序列记录：(地址, 层级, 时间桶) -> (区块号, MON wei, 42T wei)，None 表示删除
+SNAPSHOTS = {}  # 预计算的报告快照：小写地址 -> 余额、变化、最近交易和HTML片段
+SNAPSHOT_VIEWS = {}  # 小写地址 -> 最近一次被 /check 查看的时间
+WATCH_SNAPSHOTS = {}  # /watch 后台任务上次看到的余额：(小写地址, 资产) -> wei
+TOKEN_METADATA = {}  # 小写代币合约 -> {"symbol": 符号, "decimals": 小数位数}，持久化在 token_metadata 表
+ADDRESS_TOKENS = {}  # 小写地址 -> 除MON和42T外需要读取的代币合约集合（所有用户的并集）
+LOGS_STATE = {"chunk_size": LOGS_CHUNK_SIZE}  # 节点拒绝过大范围后记住缩小的区块范围
+
+HTTP_CLIENT = None  # 共享的HTTP连接池，由 init_clients 创建
+METRICS_SERVER = None  # Prometheus指标HTTP服务，由 init_clients 启动
+RPC_STATUS = {"healthy": True, "last_error": None, "last_update": None}  # 最近一次RPC请求的结果
+CONFIG_VERSION = None  # 本进程已加载的用户配置版本，多进程时与 meta 表比较
+DATA_VERSION = None  # 上次同步时数据库的 data_version，其他连接提交后会变化
+SNAPSHOT_SYNCED_AT = 0.0  # 已从数据库读取到的报告快照的最新时间
+
+_MISSING = object()
+
+class TTLCache:
+    """带TTL过期和LRU淘汰的内存缓存，相同key的并发请求共享同一次上游调用"""
+    
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._inflight = {}  # key -> 正在进行的上游请求
+        self._tasks = set()  # 正在执行的上游请求任务，保持引用避免被回收
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return entry[1]
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def discard(self, key):
+        self._data.pop(key, None)
+    
+    def clear(self):
+        self._data.clear()
+    
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight)
+        }
+    
+    def _start(self, keys):
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in keys}
+        self._inflight.update(futures)
+        return futures
+    
+    def _fail(self, futures, error):
+        for key, future in futures.items():
+            self._inflight.pop(key, None)
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+                future.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+    
+    async def _fetch_into(self, futures, fetch_many, cacheable):
+        """执行一次批量上游请求，并把结果写入缓存和等待中的 future"""
+        try:
+            fetched = await fetch_many(list(futures))
+        except BaseException as e:
+            self._fail(futures, e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for key, future in futures.items():
+            self._inflight.pop(key, None)
+            value = fetched.get(key)
+            if cacheable(value):
+                self.set(key, value)
+            future.set_result(value)
+    
+    async def get_or_fetch(self, key, fetch, cacheable=lambda value: True):
+        """获取单个key，未命中时调用 fetch() 并缓存结果"""
+        results = await self.get_many([key], lambda keys: self._fetch_one(key, fetch), cacheable)
+        return results[key]
+    
+    @staticmethod
+    async def _fetch_one(key, fetch):
+        return {key: await fetch()}
+    
+    async def get_many(self, keys, fetch_many, cacheable=lambda value: True):
+        """批量获取：命中的直接返回，已在请求中的共享结果，其余合并为一次 fetch_many(keys) 调用"""
+        results = {}
+        waiting = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.get(key)
+            if value is not _MISSING:
+                self.hits += 1
+                results[key] = value
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[key] = self._inflight[key]
+            else:
+                self.misses += 1
+                missing.append(key)
+        
+        if missing:
+            futures = self._start(missing)
+            # 上游请求放在独立任务里，发起者被取消时其他等待者仍能拿到结果
+            task = asyncio.ensure_future(self._fetch_into(futures, fetch_many, cacheable))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            waiting.update(futures)
+        
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+        return results
+
+class Histogram:
+    """按固定分桶统计的延迟直方图，同时记录错误次数"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+    
+    def observe(self, value, error=False):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+        if error:
+            self.errors += 1
+    
+    def quantile(self, q):
+        """按分桶上界估算分位数"""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return self.buckets[-1]
+
+class MetricTimer:
+    """with 语句计时；块内抛出异常时计为错误，被取消的操作不计入"""
+    
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            return False
+        self.registry.observe(self.name, self.labels, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+class MetricsRegistry:
+    """进程内指标注册表：按 (指标名, 标签) 保存延迟直方图，可导出为Prometheus文本格式"""
+    
+    def __init__(self):
+        self.histograms = {}  # (指标名, 排序后的标签元组) -> Histogram
+    
+    def observe(self, name, labels, value, error=False):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value, error)
+    
+    def timer(self, name, **labels):
+        return MetricTimer(self, name, labels)
+    
+    def series(self, name):
+        """返回某个指标的所有 (标签字典, 直方图)"""
+        return [(dict(labels), histogram) for (metric, labels), histogram in self.histograms.items() if metric == name]
+    
+    def render(self):
+        lines = []
+        for name in sorted({metric for metric, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            errors = []
+            for labels, histogram in sorted(self.series(name), key=lambda item: sorted(item[0].items())):
+                label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+                prefix = label_text + "," if label_text else ""
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label_text}}} {histogram.total:.6f}")
+                lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+                errors.append(f"{name.removesuffix('_seconds')}_errors_total{{{label_text}}} {histogram.errors}")
+            lines.append(f"# TYPE {name.removesuffix('_seconds')}_errors_total counter")
+            lines.extend(errors)
+        return "\n".join(lines)
+
+METRICS = MetricsRegistry()
+
+class SamplingProfiler:
+    """采样分析器：后台线程定期抓取事件循环线程的调用栈，统计热点函数，开销与采样间隔成正比"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread = None
+        self.target_id = None
+        self.stop_event = threading.Event()
+        self.inclusive = Counter()  # 函数出现在调用栈中的采样次数
+        self.exclusive = Counter()  # 函数位于栈顶的采样次数
+        self.samples = 0
+        self.started_at = None
+    
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self, duration):
+        self.target_id = threading.get_ident()
+        self.stop_event.clear()
+        self.inclusive.clear()
+        self.exclusive.clear()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, args=(duration,), name="sampling-profiler", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+    
+    def _run(self, duration):
+        deadline = time.monotonic() + duration
+        while not self.stop_event.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.target_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.exclusive[self._key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                key = self._key(frame)
+                if key not in seen:
+                    seen.add(key)
+                    self.inclusive[key] += 1
+                frame = frame.f_back
+    
+    @staticmethod
+    def _key(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+    
+    def report(self, limit=15):
+        """按栈顶采样次数列出热点函数，同时给出包含子调用的占比"""
+        if not self.samples:
+            return "没有采样数据"
+        lines = [f"采样 {self.samples} 次，间隔 {self.interval * 1000:g}ms", f"{'self':>6} {'total':>6}  function"]
+        for key, count in self.exclusive.most_common(limit):
+            lines.append(f"{count / self.samples:>6.1%} {self.inclusive[key] / self.samples:>6.1%}  {key}")
+        return "\n".join(lines)
+
+PROFILER = SamplingProfiler(PROFILE_INTERVAL)
+
+BALANCE_CACHE = TTLCache(BALANCE_CACHE_TTL, CACHE_MAX_SIZE)  # 地址 -> (MON wei, 42T wei, 区块号)
+ACTIVITY_CACHE = TTLCache(ACTIVITY_CACHE_TTL, CACHE_MAX_SIZE)  # (地址, 条数) -> 最近交易列表
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    watch INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS watched_addresses (
+    user_id TEXT NOT NULL,
+    address TEXT NOT NULL,
+    added_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, address)
+);
+CREATE INDEX IF NOT EXISTS idx_watched_addresses_address ON watched_addresses (address);
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    address TEXT PRIMARY KEY,
+    mon TEXT,
+    t42 TEXT,
+    last_update TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS indexed_transactions (
+    address TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (address, hash)
+);
+CREATE INDEX IF NOT EXISTS idx_indexed_transactions_block ON indexed_transactions (address, block);
+CREATE TABLE IF NOT EXISTS balance_series (
+    address TEXT NOT NULL,
+    tier INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    mon BLOB NOT NULL,
+    t42 BLOB NOT NULL,
+    PRIMARY KEY (address, tier, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS watched_tokens (
+    user_id TEXT NOT NULL,
+    token TEXT NOT NULL,
+    address TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (user_id, token, address)
+);
+CREATE TABLE IF NOT EXISTS token_metadata (
+    token TEXT PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    decimals INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report_snapshots (
+    address TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    viewed REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_report_snapshots_updated ON report_snapshots (updated);
+CREATE INDEX IF NOT EXISTS idx_report_snapshots_viewed ON report_snapshots (viewed);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def init_storage(path=DB_FILE):
+    """打开SQLite数据库（WAL模式），建表并迁移旧的JSON文件"""
+    global DB
+    DB = sqlite3.connect(path, check_same_thread=False)
+    DB.execute("PRAGMA journal_mode=WAL")
+    DB.execute("PRAGMA synchronous=NORMAL")
+    DB.executescript(DB_SCHEMA)
+    migrate_json_files()
+    migrate_balance_units()
+    migrate_report_snapshots()
+
+def close_storage():
+    """写入未保存的数据并关闭数据库"""
+    global DB
+    if DB is not None:
+        flush_balance_history()
+        flush_balance_series()
+        save_tx_index()
+        DB.close()
+        DB = None
+
+def get_meta(key, default=None):
+    row = DB.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def set_meta(key, value):
+    DB.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+def migrate_json_files():
+    """一次性把 user_configs.json / balance_history.json / tx_index.json 导入数据库"""
+    if get_meta("json_migrated"):
+        return
+    
+    try:
+        with DB:
+            if os.path.exists("user_configs.json"):
+                with open("user_configs.json", "r") as f:
+                    configs = json.load(f)
+                now = datetime.now().isoformat()
+                for user_id, config in configs.items():
+                    DB.execute(
+                        "INSERT OR REPLACE INTO users (user_id, chat_id, watch) VALUES (?, ?, ?)",
+                        (user_id, config.get("chat_id"), int(bool(config.get("watch"))))
+                    )
+                    DB.executemany(
+                        "INSERT OR IGNORE INTO watched_addresses (user_id, address, added_at) VALUES (?, ?, ?)",
+                        [(user_id, address, now) for address in config.get("addresses", [])]
+                    )
+            
+            if os.path.exists("balance_history.json"):
+                with open("balance_history.json", "r") as f:
+                    history = json.load(f)
+                DB.executemany(
+                    "INSERT OR REPLACE INTO balance_snapshots (address, mon, t42, last_update) VALUES (?, ?, ?, ?)",
+                    [
+                        (address, str(entry.get("mon")), str(entry.get("42t")), entry.get("last_update", ""))
+                        for address, entry in history.items()
+                    ]
+                )
+            
+            if os.path.exists(TX_INDEX_FILE):
+                with open(TX_INDEX_FILE, "r") as f:
+                    tx_index = json.load(f)
+                DB.executemany(
+                    "INSERT OR IGNORE INTO indexed_transactions (address, hash, block, entry) VALUES (?, ?, ?, ?)",
+                    [
+                        (address, entry["hash"], entry["block"], json.dumps(entry))
+                        for address, entries in tx_index.get("addresses", {}).items()
+                        for entry in entries
+                    ]
+                )
+                set_meta("last_block", tx_index.get("last_block"))
+                set_meta("backfilled", tx_index.get("backfilled", []))
+            
+            set_meta("json_migrated", True)
+    except Exception as e:
+        print(f"Error migrating JSON files: {e}")
+        return
+    
+    for path in ("user_configs.json", "balance_history.json", TX_INDEX_FILE):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+
+def display_to_wei(value):
+    """把旧版本按显示单位保存的余额文本转换为整数wei"""
+    if value in (None, "Error", "None"):
+        return None
+    return int(Decimal(value) * 10 ** 18)
+
+def migrate_balance_units():
+    """旧版本的余额快照按显示单位（MON为Decimal、42T为float）保存，一次性转换为整数wei"""
+    if get_meta("balance_units") == "wei":
+        return
+    rows = DB.execute("SELECT address, mon, t42 FROM balance_snapshots").fetchall()
+    with DB:
+        DB.executemany(
+            "UPDATE balance_snapshots SET mon = ?, t42 = ? WHERE address = ?",
+            [(store_balance(display_to_wei(mon)), store_balance(display_to_wei(t42)), address) for address, mon, t42 in rows]
+        )
+        set_meta("balance_units", "wei")
+
+def migrate_report_snapshots():
+    """旧版本保存的报告快照HTML包含所有用户的代币，也可能是读取失败的快照，升级后一次性清空，由后台刷新重建"""
+    if get_meta("report_snapshots") == "per_user_tokens":
+        return
+    with DB:
+        DB.execute("DELETE FROM report_snapshots")
+        set_meta("report_snapshots", "per_user_tokens")
+
+def store_balance(value):
+    """整数wei以十进制文本保存，避免超出SQLite的64位整数范围"""
+    return str(value) if value is not None else None
+
+def parse_stored_balance(value):
+    """把数据库中保存的余额文本还原为整数wei"""
+    if value in (None, "Error", "None"):
+        return None
+    return int(value)
 
 def load_user_configs():
-    global USER_CONFIGS, BALANCE_HISTORY
+    """从数据库加载用户配置和余额快照"""
+    global USER_CONFIGS, BALANCE_HISTORY, CONFIG_VERSION
+    CONFIG_VERSION = get_meta("config_version")
+    USER_CONFIGS = {}
+    for user_id, chat_id, watch in DB.execute("SELECT user_id, chat_id, watch FROM users"):
+        USER_CONFIGS[user_id] = {"addresses": [], "watch": bool(watch), "chat_id": chat_id}
+    for user_id, address in DB.execute("SELECT user_id, address FROM watched_addresses ORDER BY rowid"):
+        USER_CONFIGS.setdefault(user_id, {"addresses": []})["addresses"].append(address)
+    
+    for user_id, token, address in DB.execute("SELECT user_id, token, address FROM watched_tokens ORDER BY rowid"):
+        USER_CONFIGS.setdefault(user_id, {"addresses": []}).setdefault("tokens", []).append((token, address))
+    
+    USER_ADDRESS_INDEX.clear()
+    for user_id, config in USER_CONFIGS.items():
+        USER_ADDRESS_INDEX[user_id] = {address.lower() for address in config["addresses"]}
+    
+    TOKEN_METADATA.clear()
+    for token, symbol, decimals in DB.execute("SELECT token, symbol, decimals FROM token_metadata"):
+        TOKEN_METADATA[token] = {"symbol": symbol, "decimals": decimals}
+    rebuild_token_index()
+    
+    BALANCE_HISTORY = {}
+    for address, mon, t42, last_update in DB.execute("SELECT address, mon, t42, last_update FROM balance_snapshots"):
+        BALANCE_HISTORY[address] = {
+            "mon": parse_stored_balance(mon),
+            "42t": parse_stored_balance(t42),
+            "last_update": last_update
+        }
+
+def save_user(user_id):
+    """保存单个用户的推送设置"""
+    config = USER_CONFIGS.get(user_id, {})
+    with DB:
+        DB.execute(
+            "INSERT OR REPLACE INTO users (user_id, chat_id, watch) VALUES (?, ?, ?)",
+            (user_id, config.get("chat_id"), int(bool(config.get("watch"))))
+        )
+        bump_config_version()
+
+def save_user_addresses(user_id, addresses):
+    """在一个事务中追加用户的监控地址"""
+    now = datetime.now().isoformat()
+    with DB:
+        DB.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        DB.executemany(
+            "INSERT OR IGNORE INTO watched_addresses (user_id, address, added_at) VALUES (?, ?, ?)",
+            [(user_id, address, now) for address in addresses]
+        )
+        bump_config_version()
+
+def delete_user_addresses(user_id, addresses):
+    """在一个事务中删除用户的监控地址"""
+    with DB:
+        DB.executemany(
+            "DELETE FROM watched_addresses WHERE user_id = ? AND lower(address) = ?",
+            [(user_id, address.lower()) for address in addresses]
+        )
+        bump_config_version()
+
+def save_user_token(user_id, token, address):
+    """保存用户监控的代币，address 为空表示用户的所有地址"""
+    with DB:
+        DB.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        DB.execute(
+            "INSERT OR IGNORE INTO watched_tokens (user_id, token, address) VALUES (?, ?, ?)",
+            (user_id, token, address)
+        )
+        bump_config_version()
+
+def delete_user_tokens(user_id, entries):
+    """删除用户监控的代币"""
+    with DB:
+        DB.executemany(
+            "DELETE FROM watched_tokens WHERE user_id = ? AND token = ? AND address = ?",
+            [(user_id, token, address) for token, address in entries]
+        )
+        bump_config_version()
+
+def bump_config_version():
+    """在写用户配置的事务中递增配置版本号，其他工作进程据此重新加载"""
+    global CONFIG_VERSION
+    DB.execute(
+        "INSERT INTO meta (key, value) VALUES ('config_version', '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+    version = get_meta("config_version")
+    # 期间有其他进程修改过配置时保留旧版本号，下次同步会完整重新加载
+    if (CONFIG_VERSION is None and version == 1) or (CONFIG_VERSION is not None and version == CONFIG_VERSION + 1):
+        CONFIG_VERSION = version
+
+def sync_shared_state():
+    """多进程模式下检查其他进程是否修改了用户配置，有变化时从数据库重新加载"""
+    global DATA_VERSION
+    if not SHARED_STATE or DB is None:
+        return
+    # data_version 只在其他连接提交后变化，没有变化时不用查询 meta 表
+    data_version = DB.execute("PRAGMA data_version").fetchone()[0]
+    if data_version == DATA_VERSION:
+        return
+    DATA_VERSION = data_version
+    if get_meta("config_version") != CONFIG_VERSION:
+        flush_balance_history()
+        load_user_configs()
+
+def owns_address(key):
+    """按地址哈希把后台刷新和推送分给各工作进程，每个地址只由一个进程负责"""
+    return WORKER_COUNT == 1 or int(key[-8:], 16) % WORKER_COUNT == WORKER_INDEX
+
+def save_report_snapshots(snapshots):
+    """把刷新后的报告快照写入数据库，重启后和其他工作进程都可以直接使用；余额读取失败的快照不保存"""
+    if not snapshots or DB is None:
+        return
+    rows = [
+        (
+            snapshot["address"].lower(),
+            json.dumps({key: value for key, value in snapshot.items() if key != "next_refresh"}),
+            snapshot["updated"]
+        )
+        for snapshot in snapshots
+        if snapshot["mon_wei"] is not None and snapshot["t42_wei"] is not None
+    ]
+    if not rows:
+        return
+    try:
+        with DB:
+            DB.executemany(
+                "INSERT INTO report_snapshots (address, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(address) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                rows
+            )
+    except Exception as e:
+        print(f"Error saving report snapshots: {e}")
+
+def mark_snapshots_viewed(keys, now):
+    """记录地址被 /check 查看的时间，负责刷新该地址的进程据此提高刷新频率；还没有快照的地址先写入 updated 为0的占位记录"""
     try:
-        if os.path.exists("user_configs.json"):
-            with open("user_configs.json", "r") as f:
-                USER_CONFIGS = json.load(f)
-        if os.path.exists("balance_history.json"):
-            with open("balance_history.json", "r") as f:
-                BALANCE_HISTORY = json.load(f)
+        with DB:
+            DB.executemany(
+                "INSERT INTO report_snapshots (address, data, updated, viewed) VALUES (?, '{}', 0, ?) "
+                "ON CONFLICT(address) DO UPDATE SET viewed = excluded.viewed",
+                [(key, now) for key in keys]
+            )
     except Exception as e:
-        USER_CONFIGS = {}
-        BALANCE_HISTORY = {}
+        print(f"Error saving snapshot views: {e}")
+
+def sync_report_snapshots(since=None):
+    """读取数据库中比本地新的报告快照和查看时间（来自其他工作进程或上次运行）"""
+    global SNAPSHOT_SYNCED_AT
+    if since is None:
+        # 多读一个检查间隔，避免漏掉时间较早但提交较晚的记录
+        since = SNAPSHOT_SYNCED_AT - SNAPSHOT_TICK_INTERVAL
+    now = time.time()
+    rows = DB.execute(
+        "SELECT address, data, updated, viewed FROM report_snapshots WHERE updated > ? OR viewed > ?",
+        (since, since)
+    ).fetchall()
+    for key, data, updated, viewed in rows:
+        SNAPSHOT_SYNCED_AT = max(SNAPSHOT_SYNCED_AT, updated, viewed)
+        if viewed > SNAPSHOT_VIEWS.get(key, 0):
+            SNAPSHOT_VIEWS[key] = viewed
+        snapshot = SNAPSHOTS.get(key)
+        if updated and (snapshot is None or snapshot["updated"] < updated):
+            snapshot = SNAPSHOTS[key] = json.loads(data)
+            snapshot["next_refresh"] = updated + snapshot_interval(key, now)
+        elif snapshot is not None:
+            snapshot["next_refresh"] = min(snapshot["next_refresh"], snapshot["updated"] + snapshot_interval(key, now))
+
+def prune_report_snapshots(now=None):
+    """删除长时间没有刷新也没有被查看的报告快照"""
+    cutoff = (now or time.time()) - SNAPSHOT_MAX_AGE
+    with DB:
+        DB.execute("DELETE FROM report_snapshots WHERE updated < ? AND viewed < ?", (cutoff, cutoff))
+
+def save_token_metadata(metadata):
+    """保存代币元数据，每个合约只需读取一次"""
+    with DB:
+        DB.executemany(
+            "INSERT OR REPLACE INTO token_metadata (token, symbol, decimals) VALUES (?, ?, ?)",
+            [(token, info["symbol"], info["decimals"]) for token, info in metadata.items()]
+        )
+
+def flush_balance_history():
+    """把有变化的余额快照批量写入数据库"""
+    if not DIRTY_SNAPSHOTS or DB is None:
+        return
+    rows = [
+        (address, store_balance(BALANCE_HISTORY[address]["mon"]), store_balance(BALANCE_HISTORY[address]["42t"]), BALANCE_HISTORY[address]["last_update"])
+        for address in DIRTY_SNAPSHOTS if address in BALANCE_HISTORY
+    ]
+    DIRTY_SNAPSHOTS.clear()
+    try:
+        with DB:
+            DB.executemany(
+                "INSERT OR REPLACE INTO balance_snapshots (address, mon, t42, last_update) VALUES (?, ?, ?, ?)",
+                rows
+            )
+    except Exception as e:
+        print(f"Error saving balance history: {e}")
+
+async def flush_balance_history_job(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：定期批量写入余额快照和时间序列"""
+    flush_balance_history()
+    flush_balance_series()
+
+def clear_balance_history():
+    """清除所有余额快照"""
+    BALANCE_HISTORY.clear()
+    DIRTY_SNAPSHOTS.clear()
+    with DB:
+        DB.execute("DELETE FROM balance_snapshots")
+
+def pack_wei(value):
+    """把整数wei编码为最短的大端字节串"""
+    return value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+
+def unpack_wei(data):
+    return int.from_bytes(data, "big")
+
+def get_last_sample(address, tier):
+    """获取 (地址, 层级) 的最后一条记录，优先使用内存中的值"""
+    key = (address, tier)
+    if key not in SERIES_LAST:
+        row = DB.execute(
+            "SELECT ts, block, mon, t42 FROM balance_series WHERE address = ? AND tier = ? ORDER BY ts DESC LIMIT 1",
+            (address, tier)
+        ).fetchone()
+        SERIES_LAST[key] = (row[0], row[1], unpack_wei(row[2]), unpack_wei(row[3])) if row else None
+    return SERIES_LAST[key]
+
+def record_balance_sample(address, block_number, timestamp, mon_wei, t42_wei):
+    """追加一个余额采样；余额是阶梯函数，只在数值变化时写入，汇总层级每个时间桶只保留最后一条"""
+    if DB is None:
+        return
+    address = address.lower()
+    timestamp = int(timestamp)
+    for tier, (interval, _) in enumerate(HISTORY_TIERS):
+        last = get_last_sample(address, tier)
+        if last is not None:
+            if (last[2], last[3]) == (mon_wei, t42_wei) or timestamp <= last[0]:
+                continue
+            if interval and last[0] // interval == timestamp // interval:
+                # 同一时间桶内用最新的余额替换之前的记录，已写入数据库的在下次批量写入时删除
+                if SERIES_PENDING.pop((address, tier, last[0]), None) is None:
+                    SERIES_PENDING[(address, tier, last[0])] = None
+        SERIES_LAST[(address, tier)] = (timestamp, block_number, mon_wei, t42_wei)
+        SERIES_PENDING[(address, tier, timestamp)] = (block_number, mon_wei, t42_wei)
+
+def flush_balance_series():
+    """把待写入的时间序列记录批量写入数据库，值为None的记录表示被同一时间桶的新采样替换"""
+    if not SERIES_PENDING or DB is None:
+        return
+    rows = [
+        (address, tier, bucket, sample[0], pack_wei(sample[1]), pack_wei(sample[2]))
+        for (address, tier, bucket), sample in SERIES_PENDING.items()
+        if sample is not None
+    ]
+    deleted = [key for key, sample in SERIES_PENDING.items() if sample is None]
+    SERIES_PENDING.clear()
+    try:
+        with DB:
+            DB.executemany("DELETE FROM balance_series WHERE address = ? AND tier = ? AND ts = ?", deleted)
+            DB.executemany(
+                "INSERT OR REPLACE INTO balance_series (address, tier, ts, block, mon, t42) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+    except Exception as e:
+        print(f"Error saving balance series: {e}")
+
+def prune_balance_series(now=None):
+    """按各层级的保留时间删除过期记录，每个地址保留截止时间前的最后一条作为窗口起点的余额"""
+    now = int(now or time.time())
+    flush_balance_series()
+    with DB:
+        for tier, (_, retention) in enumerate(HISTORY_TIERS):
+            DB.execute(
+                "DELETE FROM balance_series WHERE tier = ? AND ts < ("
+                "SELECT MAX(ts) FROM balance_series AS newest "
+                "WHERE newest.address = balance_series.address AND newest.tier = balance_series.tier AND newest.ts <= ?)",
+                (tier, now - retention)
+            )
+    SERIES_LAST.clear()
+
+async def prune_balance_series_job(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：定期清理过期的时间序列记录和报告快照"""
+    prune_balance_series()
+    prune_report_snapshots()
+
+def choose_history_tier(start, end, points=None, now=None):
+    """选择保留时间覆盖查询起点的层级；指定点数时选择精度不超过每点间隔的最细层级"""
+    now = now or time.time()
+    covering = [
+        tier for tier, (_, retention) in enumerate(HISTORY_TIERS)
+        if now - retention <= start
+    ] or [len(HISTORY_TIERS) - 1]
+    if points:
+        step = (end - start) / points
+        for tier in covering:
+            if HISTORY_TIERS[tier][0] <= step:
+                return tier
+    return covering[0]
+
+def get_sample_at(address, tier, timestamp):
+    """获取某一时刻的余额（该时刻之前最后一条记录）"""
+    row = DB.execute(
+        "SELECT ts, block, mon, t42 FROM balance_series WHERE address = ? AND tier = ? AND ts <= ? ORDER BY ts DESC LIMIT 1",
+        (address, tier, timestamp)
+    ).fetchone()
+    return (row[0], row[1], unpack_wei(row[2]), unpack_wei(row[3])) if row else None
+
+def query_balance_series(address, start, end, points=HISTORY_POINTS):
+    """查询地址在时间范围内的余额，降采样为 points 个间隔（含起点）：[(时间, 区块号, MON wei, 42T wei)]"""
+    flush_balance_series()
+    address = address.lower()
+    tier = choose_history_tier(start, end, points)
+    rows = DB.execute(
+        "SELECT ts, block, mon, t42 FROM balance_series WHERE address = ? AND tier = ? AND ts > ? AND ts <= ? ORDER BY ts",
+        (address, tier, start, end)
+    ).fetchall()
+    
+    current = get_sample_at(address, tier, start)
+    result = []
+    i = 0
+    step = (end - start) / points
+    for k in range(points + 1):
+        boundary = start + step * k
+        while i < len(rows) and rows[i][0] <= boundary:
+            current = (rows[i][0], rows[i][1], unpack_wei(rows[i][2]), unpack_wei(rows[i][3]))
+            i += 1
+        if current is not None:
+            result.append((int(boundary), current[1], current[2], current[3]))
+    return result
+
+def get_balance_range_change(address, start, end):
+    """获取地址在时间范围起点和终点的余额，没有数据时返回None"""
+    flush_balance_series()
+    address = address.lower()
+    tier = choose_history_tier(start, end)
+    end_point = get_sample_at(address, tier, end)
+    if end_point is None:
+        return None
+    start_point = get_sample_at(address, tier, start)
+    if start_point is None:
+        # 地址在范围内才开始记录，以第一条记录作为起点
+        row = DB.execute(
+            "SELECT ts, block, mon, t42 FROM balance_series WHERE address = ? AND tier = ? AND ts > ? ORDER BY ts LIMIT 1",
+            (address, tier, start)
+        ).fetchone()
+        start_point = (row[0], row[1], unpack_wei(row[2]), unpack_wei(row[3]))
+    return start_point, end_point
+
+def get_samples_at(addresses, tier, timestamp):
+    """批量获取多个地址在某一时刻的余额，该时刻之前没有记录的地址取之后第一条：小写地址 -> (MON wei, 42T wei)"""
+    addresses = [address.lower() for address in addresses]
+    samples = {}
+    for i in range(0, len(addresses), SQLITE_BATCH_SIZE):
+        chunk = addresses[i:i + SQLITE_BATCH_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        # SQLite聚合查询中的其他列取自 MAX/MIN 所在的那一行，每批地址只需一次分组查询
+        for aggregate, condition in (("MAX", "<="), ("MIN", ">")):
+            rows = DB.execute(
+                f"SELECT address, {aggregate}(ts), mon, t42 FROM balance_series "
+                f"WHERE tier = ? AND ts {condition} ? AND address IN ({placeholders}) GROUP BY address",
+                (tier, timestamp, *chunk)
+            )
+            for address, _, mon, t42 in rows:
+                samples.setdefault(address, (unpack_wei(mon), unpack_wei(t42)))
+    return samples
 
-def save_user_configs():
+def load_tx_index():
+    """从数据库加载区块索引"""
+    global TX_INDEX
+    TX_INDEX = {
+        "last_block": get_meta("last_block"),
+        "addresses": {},
+        "backfilled": get_meta("backfilled", [])
+    }
+    for address, entry in DB.execute("SELECT address, entry FROM indexed_transactions ORDER BY address, block DESC"):
+        TX_INDEX["addresses"].setdefault(address, []).append(json.loads(entry))
+
+def save_tx_index():
+    """只重写有变化地址的索引记录，并保存索引进度"""
+    if DB is None:
+        return
     try:
-        with open("user_configs.json", "w") as f:
-            json.dump(USER_CONFIGS, f, indent=4)
-        with open("balance_history.json", "w") as f:
-            json.dump(BALANCE_HISTORY, f, indent=4)
+        with DB:
+            for address in DIRTY_TX_INDEX:
+                DB.execute("DELETE FROM indexed_transactions WHERE address = ?", (address,))
+                DB.executemany(
+                    "INSERT INTO indexed_transactions (address, hash, block, entry) VALUES (?, ?, ?, ?)",
+                    [(address, entry["hash"], entry["block"], json.dumps(entry)) for entry in TX_INDEX["addresses"].get(address, [])]
+                )
+            set_meta("last_block", TX_INDEX["last_block"])
+            set_meta("backfilled", TX_INDEX["backfilled"])
+        DIRTY_TX_INDEX.clear()
     except Exception as e:
-        print(f"Error saving configs: {e}")
+        print(f"Error saving tx index: {e}")
 
-def get_token_balance(w3, address, token_address=None):
-    """获取代币余额"""
+def render_metrics():
+    """生成Prometheus文本格式的全部指标：延迟直方图加上缓存、发送队列和RPC节点的当前状态"""
+    lines = [METRICS.render()]
+    lines.append("# TYPE fortytwo_cache_events_total counter")
+    for name, cache in (("balance", BALANCE_CACHE), ("activity", ACTIVITY_CACHE)):
+        stats = cache.stats()
+        for event in ("hits", "misses", "coalesced"):
+            lines.append(f'fortytwo_cache_events_total{{cache="{name}",event="{event}"}} {stats[event]}')
+    lines.append("# TYPE fortytwo_cache_entries gauge")
+    for name, cache in (("balance", BALANCE_CACHE), ("activity", ACTIVITY_CACHE)):
+        lines.append(f'fortytwo_cache_entries{{cache="{name}"}} {cache.stats()["size"]}')
+    stats = OUTBOX.stats()
+    lines.append("# TYPE fortytwo_outbox_depth gauge")
+    lines.append(f"fortytwo_outbox_depth {stats['depth']}")
+    lines.append("# TYPE fortytwo_outbox_messages_total counter")
+    for event in ("sent", "merged", "retry_after", "failed"):
+        lines.append(f'fortytwo_outbox_messages_total{{event="{event}"}} {stats[event]}')
+    lines.append("# TYPE fortytwo_rpc_endpoint_requests_total counter")
+    endpoints = RPC_ROUTER.stats()
+    for endpoint in endpoints:
+        lines.append(f'fortytwo_rpc_endpoint_requests_total{{url="{endpoint["url"]}"}} {endpoint["requests"]}')
+    lines.append("# TYPE fortytwo_rpc_endpoint_errors_total counter")
+    for endpoint in endpoints:
+        lines.append(f'fortytwo_rpc_endpoint_errors_total{{url="{endpoint["url"]}"}} {endpoint["errors"]}')
+    return "\n".join(line for line in lines if line) + "\n"
+
+async def read_http_head(reader, timeout):
+    """读取HTTP请求行和请求头，返回 (方法, 路径, 小写请求头字典)"""
+    request_line = await asyncio.wait_for(reader.readline(), timeout)
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        return None, None, headers
+    return parts[0], parts[1].split("?")[0], headers
+
+async def handle_metrics_request(reader, writer):
+    """极简HTTP处理：GET /metrics 返回指标，其余路径返回404，每次响应后关闭连接"""
     try:
-        if token_address is None:
-            # 原生代币 (MON)
-            balance = w3.eth.get_balance(address)
-            return w3.from_wei(balance, 'ether')
+        method, path, _ = await read_http_head(reader, 5)
+        if method == "GET" and path == "/metrics":
+            status, body = "200 OK", render_metrics().encode()
         else:
-            # ERC20代币 (42T)
-            abi = [
-                {
-                    "constant": True,
-                    "inputs": [{"name": "_owner", "type": "address"}],
-                    "name": "balanceOf",
-                    "outputs": [{"name": "balance", "type": "uint256"}],
-                    "type": "function"
-                }
-            ]
-            contract = w3.eth.contract(address=token_address, abi=abi)
-            balance = contract.functions.balanceOf(address).call()
-            return balance / (10 ** 18)  # 假设18位小数
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    """在本地端口启动Prometheus指标服务，多进程时每个工作进程使用 METRICS_PORT + 序号，端口被占用时只打印警告"""
+    global METRICS_SERVER
+    if not METRICS_PORT:
+        return
+    port = METRICS_PORT + WORKER_INDEX
+    try:
+        METRICS_SERVER = await asyncio.start_server(handle_metrics_request, METRICS_HOST, port)
+        print(f"Metrics endpoint listening on http://{METRICS_HOST}:{port}/metrics")
+    except OSError as e:
+        print(f"Failed to start metrics endpoint on {METRICS_HOST}:{port}: {e}")
+
+async def init_clients(application):
+    """启动时创建共享的HTTP连接池并启动Telegram发送队列"""
+    global HTTP_CLIENT
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+    HTTP_CLIENT = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits)
+    OUTBOX.start(application.bot)
+    await start_metrics_server()
+
+async def close_clients(application):
+    """关闭时停止指标服务和发送队列并释放HTTP连接池"""
+    global HTTP_CLIENT, METRICS_SERVER
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.close()
+        await METRICS_SERVER.wait_closed()
+        METRICS_SERVER = None
+    if PROFILER.running():
+        PROFILER.stop()
+    await OUTBOX.stop()
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
+
+async def shutdown(application):
+    """关闭时释放连接池并写入未保存的数据"""
+    await close_clients(application)
+    close_storage()
+
+class RpcRateLimited(Exception):
+    """节点返回429或限流错误"""
+
+def is_rate_limit_message(message):
+    message = str(message).lower()
+    return "rate limit" in message or "too many requests" in message or "429" in message
+
+class RpcEndpoint:
+    """单个RPC节点的延迟、错误率和令牌桶状态"""
+    
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # 延迟EWMA（秒）
+        self.error_rate = 0.0  # 错误率EWMA
+        self.latencies = deque(maxlen=200)
+        self.limit = RPC_RATE_LIMIT / WORKER_COUNT  # 多进程时各工作进程平分节点的限速
+        self.rate = self.limit
+        self.tokens = self.limit
+        self.refilled_at = time.monotonic()
+        self.backoff_until = 0.0
+        self.failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+    
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.backoff_until
+    
+    def score(self):
+        """越小越好：延迟EWMA按错误率加权，未测量过的节点优先试探"""
+        latency = self.latency if self.latency is not None else 0.0
+        return latency * (1 + 4 * self.error_rate)
+    
+    def hedge_delay(self):
+        """按历史延迟分位数计算发送对冲请求前的等待时间"""
+        if len(self.latencies) < 10:
+            return max(RPC_HEDGE_MIN_DELAY, (self.latency or 0.5) * 2)
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * RPC_HEDGE_PERCENTILE))
+        return max(RPC_HEDGE_MIN_DELAY, ordered[index])
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+    
+    async def acquire(self):
+        """令牌桶限速，令牌不足时等待"""
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+    
+    def observe_latency(self, latency):
+        self.latencies.append(latency)
+        self.latency = latency if self.latency is None else RPC_EWMA_ALPHA * latency + (1 - RPC_EWMA_ALPHA) * self.latency
+    
+    def record_success(self, latency):
+        self.requests += 1
+        self.observe_latency(latency)
+        self.error_rate *= 1 - RPC_EWMA_ALPHA
+        self.failures = 0
+        # 成功后逐步恢复被限流降低的速率
+        self.rate = min(self.limit, self.rate * 1.05)
+    
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate = RPC_EWMA_ALPHA + (1 - RPC_EWMA_ALPHA) * self.error_rate
+        self.failures += 1
+        self.backoff_until = time.monotonic() + min(30.0, 0.5 * 2 ** self.failures)
+    
+    def record_rate_limited(self, retry_after=None):
+        self.requests += 1
+        self.rate_limited += 1
+        self.error_rate = RPC_EWMA_ALPHA + (1 - RPC_EWMA_ALPHA) * self.error_rate
+        self.rate = max(0.5, self.rate / 2)
+        self.tokens = 0
+        self.failures += 1
+        self.backoff_until = time.monotonic() + (retry_after if retry_after else min(30.0, 2 ** self.failures))
+
+class RpcRouter:
+    """多节点RPC路由：选择最快的健康节点，慢请求发送对冲请求，失败或限流时自动切换"""
+    
+    def __init__(self, urls):
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+        self.hedged = 0
+    
+    def ranked(self, exclude=()):
+        """按评分排序的健康节点，退避中的节点不参与"""
+        now = time.monotonic()
+        return sorted((e for e in self.endpoints if e.healthy(now) and e not in exclude), key=RpcEndpoint.score)
+    
+    async def _send(self, endpoint, payload, sent_at=None):
+        await endpoint.acquire()
+        started = time.monotonic()
+        if sent_at is not None:
+            sent_at[endpoint] = asyncio.get_running_loop().time()
+        try:
+            response = await HTTP_CLIENT.post(endpoint.url, json=payload)
+        except asyncio.CancelledError:
+            # 被对冲请求抢先时，用已耗时作为延迟下限，避免继续优先选择慢节点
+            endpoint.observe_latency(time.monotonic() - started)
+            raise
+        except Exception:
+            endpoint.record_error()
+            raise
+        
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            endpoint.record_rate_limited(float(retry_after) if retry_after and retry_after.isdigit() else None)
+            raise RpcRateLimited(f"{endpoint.url} rate limited")
+        if not response.is_success:
+            endpoint.record_error()
+            response.raise_for_status()
+        
+        data = response.json()
+        error = data.get("error") if isinstance(data, dict) else None
+        if error and is_rate_limit_message(error.get("message", "")):
+            endpoint.record_rate_limited()
+            raise RpcRateLimited(f"{endpoint.url} rate limited: {error.get('message')}")
+        endpoint.record_success(time.monotonic() - started)
+        return data
+    
+    async def request(self, payload):
+        """发送JSON-RPC请求并返回第一个成功的响应"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RPC_CALL_DEADLINE
+        candidates = self.ranked()
+        tried = set()
+        pending = {}
+        sent_at = {}  # 节点 -> 拿到令牌、请求真正发出的时间
+        last_error = None
+        
+        def send(endpoint):
+            tried.add(endpoint)
+            pending[asyncio.ensure_future(self._send(endpoint, payload, sent_at))] = endpoint
+        
+        try:
+            while True:
+                if not pending:
+                    if not candidates:
+                        # 没有可用节点时，在时限内等待最早结束退避的节点，否则立即失败
+                        recovery = min((e.backoff_until for e in self.endpoints if e not in tried), default=None)
+                        if recovery is None:
+                            raise last_error or RuntimeError("No RPC endpoint available")
+                        delay = recovery - time.monotonic()
+                        if delay >= deadline - loop.time():
+                            raise last_error or RpcRateLimited("All RPC endpoints are backing off")
+                        await asyncio.sleep(max(0.0, delay))
+                        candidates = self.ranked(exclude=tried)
+                        continue
+                    send(candidates.pop(0))
+                
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"RPC call exceeded {RPC_CALL_DEADLINE:g}s deadline")
+                timeout = remaining
+                hedge_at = None
+                if candidates:
+                    # 还有备用节点时，从最近一个请求发出起只等待该节点的对冲延迟；还在等令牌时稍后再检查
+                    endpoint = next(reversed(pending.values()))
+                    if endpoint in sent_at:
+                        hedge_at = sent_at[endpoint] + endpoint.hedge_delay()
+                        timeout = min(remaining, max(0.0, hedge_at - loop.time()))
+                    else:
+                        timeout = min(remaining, RPC_HEDGE_MIN_DELAY)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                
+                # 当前请求太慢时发送对冲请求；有请求失败时立即切换到下一个节点
+                if candidates and pending:
+                    if not done:
+                        if hedge_at is None:
+                            continue
+                        self.hedged += 1
+                    send(candidates.pop(0))
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def stats(self):
+        now = time.monotonic()
+        return [
+            {
+                "url": e.url,
+                "latency_ms": round(e.latency * 1000) if e.latency is not None else None,
+                "error_rate": round(e.error_rate, 3),
+                "rate": round(e.rate, 2),
+                "requests": e.requests,
+                "errors": e.errors,
+                "rate_limited": e.rate_limited,
+                "backoff": max(0.0, round(e.backoff_until - now, 1))
+            }
+            for e in self.endpoints
+        ]
+
+RPC_ROUTER = RpcRouter(MONAD_RPC_URLS)
+
+def record_rpc_result(error=None):
+    """根据最近一次RPC请求的结果更新节点健康状态"""
+    RPC_STATUS["healthy"] = error is None
+    RPC_STATUS["last_error"] = str(error) if error is not None else None
+    RPC_STATUS["last_update"] = datetime.now().isoformat()
+
+async def rpc_call(method, params):
+    """发送JSON-RPC请求到Monad节点"""
+    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+    try:
+        with METRICS.timer("fortytwo_upstream_seconds", upstream="rpc", target=method):
+            data = await RPC_ROUTER.request(payload)
     except Exception as e:
-        return "Error"
+        record_rpc_result(e)
+        raise
+    record_rpc_result()
+    if data.get("error"):
+        raise RuntimeError(data["error"].get("message", "RPC error"))
+    return data["result"]
 
-def get_recent_transactions(address, limit=3):
-    """获取最近的交易 - 使用BlockVision API"""
+async def rpc_batch(calls):
+    """发送JSON-RPC批量请求，按顺序返回结果（失败的项为异常对象）"""
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
     try:
-        # 使用BlockVision API获取账户活动
-        url = "https://api.blockvision.org/v2/monad/account/activities"
+        with METRICS.timer("fortytwo_upstream_seconds", upstream="rpc", target="batch"):
+            data = await RPC_ROUTER.request(payload)
+    except Exception as e:
+        record_rpc_result(e)
+        raise
+    record_rpc_result()
+    if isinstance(data, dict):
+        # 节点拒绝整个批量请求时只返回一个错误对象
+        raise RuntimeError(data.get("error", {}).get("message", "RPC batch error"))
+    
+    results = [RuntimeError("Missing RPC response")] * len(calls)
+    for item in data:
+        if item.get("error"):
+            results[item["id"]] = RuntimeError(item["error"].get("message", "RPC error"))
+        else:
+            results[item["id"]] = item["result"]
+    return results
+
+def encode_address_arg(address):
+    """把地址编码为32字节ABI参数，避免每次调用都走通用ABI编码器"""
+    return bytes(12) + bytes.fromhex(address[2:])
+
+def encode_balance_of(address):
+    """编码ERC20 balanceOf调用数据"""
+    return ERC20_BALANCE_OF_SELECTOR + encode_address_arg(address)
+
+def decode_uint(success, data):
+    """解码uint256返回值，调用失败时返回None"""
+    if not success or len(data) < 32:
+        return None
+    return int.from_bytes(data[:32], "big")
+
+def plan_balance_call(address, asset):
+    """把一次 (地址, 资产) 余额读取转换为Multicall3子调用"""
+    if asset == NATIVE_ASSET:
+        return (MULTICALL3_ADDRESS, True, GET_ETH_BALANCE_SELECTOR + encode_address_arg(address))
+    return (asset, True, encode_balance_of(address))
+
+def plan_holdings(addresses):
+    """列出地址需要读取的全部资产：MON、42T以及用户额外监控的代币"""
+    pairs = []
+    for address in addresses:
+        pairs.append((address, NATIVE_ASSET))
+        pairs.append((address, T42_ASSET))
+        pairs.extend((address, token) for token in sorted(ADDRESS_TOKENS.get(address.lower(), ())))
+    return pairs
+
+async def multicall_balances(pairs, block_tag="latest"):
+    """通过一次Multicall3 aggregate3调用读取一组 (地址, 资产) 余额"""
+    calls = [(MULTICALL3_ADDRESS, True, GET_BLOCK_NUMBER_SELECTOR)]
+    calls.extend(plan_balance_call(address, asset) for address, asset in pairs)
+    
+    data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+    result = await rpc_call("eth_call", [{"to": MULTICALL3_ADDRESS, "data": "0x" + data.hex()}, block_tag])
+    (returned,) = decode(["(bool,bytes)[]"], bytes.fromhex(result[2:]))
+    
+    block_number = decode_uint(*returned[0])
+    balances = {pair: decode_uint(*returned[1 + i]) for i, pair in enumerate(pairs)}
+    return balances, block_number
+
+async def rpc_batch_balances(pairs):
+    """通过JSON-RPC批量请求读取所有 (地址, 资产) 在同一区块的余额，按 RPC_BATCH_SIZE 分批并发发送"""
+    block_number = int(await rpc_call("eth_blockNumber", []), 16)
+    block_tag = hex(block_number)
+    
+    calls = []
+    for address, asset in pairs:
+        if asset == NATIVE_ASSET:
+            calls.append(("eth_getBalance", [address, block_tag]))
+        else:
+            calls.append(("eth_call", [{"to": asset, "data": "0x" + encode_balance_of(address).hex()}, block_tag]))
+    chunks = [calls[i:i + RPC_BATCH_SIZE] for i in range(0, len(calls), RPC_BATCH_SIZE)]
+    results = []
+    for chunk, chunk_results in zip(chunks, await asyncio.gather(*(rpc_batch(chunk) for chunk in chunks), return_exceptions=True)):
+        # 某一批失败时只有这一批的余额为None
+        results.extend([chunk_results] * len(chunk) if isinstance(chunk_results, Exception) else chunk_results)
+    
+    def to_int(value):
+        if isinstance(value, Exception) or value in (None, "0x"):
+            return None
+        return int(value, 16)
+    
+    return {pair: to_int(result) for pair, result in zip(pairs, results)}, block_number
+
+async def get_balances_batch(pairs):
+    """按最少的批量调用读取所有 (地址, 资产) 余额（单位wei），返回 (余额字典, 区块号)"""
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}, None
+    
+    chunks = [pairs[i:i + MULTICALL_BATCH_SIZE] for i in range(0, len(pairs), MULTICALL_BATCH_SIZE)]
+    try:
+        # 第一批决定区块号，其余批次固定在同一区块读取
+        balances, block_number = await multicall_balances(chunks[0])
+        if len(chunks) > 1:
+            rest = await asyncio.gather(*(multicall_balances(chunk, hex(block_number)) for chunk in chunks[1:]))
+            for chunk_balances, _ in rest:
+                balances.update(chunk_balances)
+        return balances, block_number
+    except Exception as e:
+        print(f"Multicall3 balance read failed, falling back to JSON-RPC batch: {e}")
+    
+    try:
+        return await rpc_batch_balances(pairs)
+    except Exception as e:
+        print(f"Error getting balances: {e}")
+        return {pair: None for pair in pairs}, None
+
+async def get_asset_balances_cached(pairs):
+    """带缓存的批量余额读取，只有未命中的 (地址, 资产) 才会合并进一次批量计划"""
+    async def fetch_many(keys):
+        balances, block_number = await get_balances_batch(keys)
+        now = time.time()
+        for address, asset in keys:
+            if asset != NATIVE_ASSET:
+                continue
+            mon_wei = balances.get((address, NATIVE_ASSET))
+            t42_wei = balances.get((address, T42_ASSET))
+            if block_number is not None and mon_wei is not None and t42_wei is not None:
+                record_balance_sample(address, block_number, now, mon_wei, t42_wei)
+        return {key: (balances.get(key), block_number) for key in keys}
+    
+    entries = await BALANCE_CACHE.get_many(
+        [(address.lower(), asset) for address, asset in pairs],
+        fetch_many,
+        cacheable=lambda entry: entry is not None and entry[0] is not None
+    )
+    balances = {(address, asset): entries[(address.lower(), asset)][0] for address, asset in pairs}
+    blocks = [entry[1] for entry in entries.values() if entry[1] is not None]
+    return balances, max(blocks) if blocks else None
+
+async def get_balances_cached(addresses):
+    """带缓存的MON和42T余额读取，返回 ({地址: (MON wei, 42T wei)}, 区块号)"""
+    pairs = [(address, asset) for address in addresses for asset in (NATIVE_ASSET, T42_ASSET)]
+    balances, block_number = await get_asset_balances_cached(pairs)
+    return {
+        address: (balances[(address, NATIVE_ASSET)], balances[(address, T42_ASSET)])
+        for address in addresses
+    }, block_number
+
+async def get_holdings_cached(addresses):
+    """把地址的MON、42T和额外代币放进同一个批量计划读取，返回 ({地址: (MON wei, 42T wei, {代币: wei})}, 区块号)"""
+    await ensure_token_metadata({T42_ASSET}.union(*(ADDRESS_TOKENS.get(address.lower(), ()) for address in addresses)))
+    balances, block_number = await get_asset_balances_cached(plan_holdings(addresses))
+    holdings = {}
+    for address in addresses:
+        tokens = {token: balances[(address, token)] for token in sorted(ADDRESS_TOKENS.get(address.lower(), ()))}
+        holdings[address] = (balances[(address, NATIVE_ASSET)], balances[(address, T42_ASSET)], tokens)
+    return holdings, block_number
+
+def decode_symbol(success, data):
+    """解码symbol()返回值，兼容返回bytes32的旧合约"""
+    if not success or not data:
+        return None
+    try:
+        return decode(["string"], data)[0][:16] or None
+    except Exception:
+        return data[:32].rstrip(b"\0").decode("utf-8", "ignore")[:16] or None
+
+async def fetch_token_metadata(tokens):
+    """通过一次Multicall3调用读取多个代币的symbol和decimals，读不到decimals的合约视为无效"""
+    calls = []
+    for token in tokens:
+        calls.append((token, True, ERC20_SYMBOL_SELECTOR))
+        calls.append((token, True, ERC20_DECIMALS_SELECTOR))
+    data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+    result = await rpc_call("eth_call", [{"to": MULTICALL3_ADDRESS, "data": "0x" + data.hex()}, "latest"])
+    (returned,) = decode(["(bool,bytes)[]"], bytes.fromhex(result[2:]))
+    
+    metadata = {}
+    for i, token in enumerate(tokens):
+        decimals = decode_uint(*returned[2 * i + 1])
+        if decimals is None or decimals > 77:
+            continue
+        metadata[token] = {"symbol": decode_symbol(*returned[2 * i]) or token[:10], "decimals": decimals}
+    return metadata
+
+async def ensure_token_metadata(tokens):
+    """确保代币元数据已缓存，只读取缺失的合约并写入数据库"""
+    missing = [token for token in tokens if token not in TOKEN_METADATA]
+    if not missing:
+        return
+    try:
+        metadata = await fetch_token_metadata(missing)
+    except Exception as e:
+        print(f"Error fetching token metadata: {e}")
+        return
+    TOKEN_METADATA.update(metadata)
+    if metadata and DB is not None:
+        save_token_metadata(metadata)
+
+def token_decimals(token):
+    return TOKEN_METADATA.get(token, {}).get("decimals", 18)
+
+def token_symbol(token):
+    if token == T42_ASSET:
+        return "42T"
+    return TOKEN_METADATA.get(token, {}).get("symbol") or token[:10]
+
+def wei_to_decimal(value, decimals=18):
+    """把整数最小单位精确转换为Decimal"""
+    with localcontext() as context:
+        context.prec = 100
+        return Decimal(value) / Decimal(10) ** decimals
+
+async def get_recent_transactions_cached(address, limit=3):
+    """带缓存的最近交易查询；所有数据源都失败时的结果不缓存，数据源恢复后立即重新查询"""
+    return await ACTIVITY_CACHE.get_or_fetch(
+        (address.lower(), limit),
+        lambda: get_recent_transactions(address, limit),
+        cacheable=lambda transactions: transactions is not None
+    )
+
+def to_display_balances(mon_wei, t42_wei):
+    """渲染时才把整数wei转换为精确的Decimal显示数值"""
+    mon_balance = Web3.from_wei(mon_wei, 'ether') if mon_wei is not None else "Error"
+    fortytwo_balance = wei_to_decimal(t42_wei, token_decimals(T42_ASSET)) if t42_wei is not None else "Error"
+    return mon_balance, fortytwo_balance
+
+class ActivityProvider(abc.ABC):
+    """交易记录数据源的公共接口，带连续失败熔断"""
+    
+    name = "provider"
+    
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.failures = 0
+        self.open_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+    
+    def available(self):
+        return time.monotonic() >= self.open_until
+    
+    def record_success(self):
+        self.calls += 1
+        self.failures = 0
+    
+    def record_failure(self, error):
+        self.calls += 1
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= ACTIVITY_BREAKER_THRESHOLD:
+            self.open_until = time.monotonic() + ACTIVITY_BREAKER_COOLDOWN
+            print(f"{self.name} failed {self.failures} times, circuit open for {ACTIVITY_BREAKER_COOLDOWN:g}s: {error}")
+    
+    @abc.abstractmethod
+    async def fetch(self, address, limit):
+        """返回交易列表；没有记录时返回空列表，失败时抛出异常"""
+
+class BlockVisionProvider(ActivityProvider):
+    """BlockVision账户活动API"""
+    
+    name = "BlockVision"
+    
+    async def fetch(self, address, limit):
         params = {
             "address": address,
             "limit": limit,
@@ -92,171 +1647,967 @@ def get_recent_transactions(address, limit=3):
         if BLOCKVISION_API_KEY:
             headers["Authorization"] = f"Bearer {BLOCKVISION_API_KEY}"
         
-        response = requests.get(url, params=params, headers=headers, timeout=15)
+        response = await HTTP_CLIENT.get(BLOCKVISION_API_URL, params=params, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("code") != 0:
+            raise RuntimeError(f"BlockVision API error: {data.get('reason', 'Unknown error')}")
         
-        if response.ok:
-            data = response.json()
+        transactions = []
+        for activity in (data.get("result") or {}).get("data") or []:
+            # 从BlockVision API获取详细信息
+            tx_hash = activity.get("hash", "")
+            timestamp = activity.get("timestamp", 0)
+            tx_status = activity.get("txStatus", 0)
+            tx_name = activity.get("txName", "Transfer")
+            transaction_fee = activity.get("transactionFee", "0")
             
-            if data.get("code") == 0 and data.get("result", {}).get("data"):
-                transactions = []
-                
-                for activity in data["result"]["data"][:limit]:
-                    # 从BlockVision API获取详细信息
-                    tx_hash = activity.get("hash", "")
-                    timestamp = activity.get("timestamp", 0)
-                    tx_status = activity.get("txStatus", 0)
-                    tx_name = activity.get("txName", "Transfer")
-                    transaction_fee = activity.get("transactionFee", "0")
-                    
-                    # 转换时间戳（毫秒转秒）
-                    if timestamp:
-                        tx_time = datetime.fromtimestamp(timestamp / 1000)
-                        time_str = tx_time.strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        time_str = "Unknown"
-                    
-                    # 获取代币信息
-                    token_info = ""
-                    if activity.get("addTokens"):
-                        for token in activity["addTokens"]:
-                            symbol = token.get("symbol", "")
-                            amount = token.get("amount", 0)
-                            if symbol and amount:
-                                token_info += f" +{amount} {symbol}"
-                    
-                    if activity.get("subTokens"):
-                        for token in activity["subTokens"]:
-                            symbol = token.get("symbol", "")
-                            amount = token.get("amount", 0)
-                            if symbol and amount:
-                                token_info += f" -{amount} {symbol}"
-                    
-                    transactions.append({
-                        "time": time_str,
-                        "hash": tx_hash,
-                        "type": tx_name,
-                        "status": "✅" if tx_status == 1 else "❌",
-                        "fee": transaction_fee,
-                        "tokens": token_info.strip()
-                    })
-                
-                return transactions
+            # 转换时间戳（毫秒转秒）
+            if timestamp:
+                tx_time = datetime.fromtimestamp(timestamp / 1000)
+                time_str = tx_time.strftime("%Y-%m-%d %H:%M:%S")
             else:
-                print(f"BlockVision API error: {data.get('reason', 'Unknown error')}")
+                time_str = "Unknown"
+            
+            # 获取代币信息
+            token_info = ""
+            if activity.get("addTokens"):
+                for token in activity["addTokens"]:
+                    symbol = token.get("symbol", "")
+                    amount = token.get("amount", 0)
+                    if symbol and amount:
+                        token_info += f" +{amount} {symbol}"
+            
+            if activity.get("subTokens"):
+                for token in activity["subTokens"]:
+                    symbol = token.get("symbol", "")
+                    amount = token.get("amount", 0)
+                    if symbol and amount:
+                        token_info += f" -{amount} {symbol}"
+            
+            transactions.append({
+                "time": time_str,
+                "hash": tx_hash,
+                "type": tx_name,
+                "status": "✅" if tx_status == 1 else "❌",
+                "fee": transaction_fee,
+                "tokens": token_info.strip()
+            })
+        
+        return transactions[:limit]
+
+class ExplorerProvider(ActivityProvider):
+    """Monad Explorer API（多个可能的接口路径，各自独立熔断）"""
+    
+    def __init__(self, path, timeout):
+        super().__init__(timeout)
+        self.path = path
+        self.name = f"Explorer {path.split('{')[0]}"
+    
+    async def fetch(self, address, limit):
+        url = EXPLORER_URL + self.path.format(address=address)
+        response = await HTTP_CLIENT.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
         
-        # 如果BlockVision API失败，尝试备用方法
-        print(f"BlockVision API failed, trying fallback methods...")
+        transactions = []
+        tx_list = data.get("transactions", []) or data.get("data", []) or data.get("result", [])
         
-        # 备用方法1：尝试Monad Explorer API
-        fallback_urls = [
-            f"https://testnet.monadexplorer.com/api/address/{address}/transactions",
-            f"https://testnet.monadexplorer.com/api/v1/address/{address}/transactions",
-            f"https://testnet.monadexplorer.com/api/transactions?address={address}"
-        ]
+        for tx in tx_list[:limit]:
+            timestamp = tx.get("timestamp") or tx.get("time") or tx.get("blockTime")
+            tx_hash = tx.get("hash") or tx.get("txHash")
+            
+            if timestamp and tx_hash:
+                tx_time = datetime.fromtimestamp(int(timestamp))
+                transactions.append({
+                    "time": tx_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "hash": tx_hash,
+                    "type": "Transfer",
+                    "status": "✅",
+                    "fee": "0",
+                    "tokens": ""
+                })
         
-        for url in fallback_urls:
+        return transactions
+
+ACTIVITY_PROVIDERS = [
+    BlockVisionProvider(BLOCKVISION_TIMEOUT),
+    ExplorerProvider("/api/address/{address}/transactions", EXPLORER_TIMEOUT),
+    ExplorerProvider("/api/v1/address/{address}/transactions", EXPLORER_TIMEOUT),
+    ExplorerProvider("/api/transactions?address={address}", EXPLORER_TIMEOUT)
+]
+
+async def run_activity_provider(provider, address, limit):
+    """在数据源自己的时限内获取交易记录，失败时返回None"""
+    try:
+        with METRICS.timer("fortytwo_upstream_seconds", upstream="activity", target=provider.name):
+            transactions = await asyncio.wait_for(provider.fetch(address, limit), provider.timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        provider.record_failure(e)
+        return None
+    provider.record_success()
+    return transactions
+
+async def get_recent_transactions(address, limit=3):
+    """获取最近的交易 - 同时请求所有可用数据源，第一个有效结果胜出，本地区块索引兜底；所有数据源都失败且索引为空时返回None"""
+    providers = [provider for provider in ACTIVITY_PROVIDERS if provider.available()]
+    tasks = {
+        asyncio.ensure_future(run_activity_provider(provider, address, limit)): provider
+        for provider in providers
+    }
+    answered = False  # 是否有数据源成功返回（包括确实没有交易的空列表）
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks.pop(task)
+                transactions = task.result()
+                if transactions:
+                    provider.wins += 1
+                    return transactions
+                answered = answered or transactions is not None
+    finally:
+        # 取消落后的数据源请求
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # 所有数据源都没有结果时查询本地区块索引
+    indexed = get_indexed_transactions(address, limit)
+    if indexed or answered:
+        return indexed
+    return None
+
+def get_user_addresses(user_id):
+    """获取用户的监控地址列表，未配置时使用默认地址"""
+    return USER_CONFIGS.get(user_id, {}).get("addresses") or DEFAULT_ADDRESSES
+
+def get_user_tokens(user_id, address):
+    """获取用户为某个地址额外监控的代币（包括对所有地址生效的代币）"""
+    key = address.lower()
+    tokens = []
+    for token, scope in USER_CONFIGS.get(user_id, {}).get("tokens", []):
+        if scope in ("", key) and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+def rebuild_token_index():
+    """重建 地址 -> 额外代币 索引，批量读取余额时按地址取所有用户代币的并集"""
+    ADDRESS_TOKENS.clear()
+    for user_id, config in USER_CONFIGS.items():
+        if not config.get("tokens"):
+            continue
+        for address in get_user_addresses(user_id):
+            tokens = get_user_tokens(user_id, address)
+            if tokens:
+                ADDRESS_TOKENS.setdefault(address.lower(), set()).update(tokens)
+
+def get_watched_addresses():
+    """获取所有用户监控地址的并集（小写）"""
+    watched = {address.lower() for address in DEFAULT_ADDRESSES}
+    for config in USER_CONFIGS.values():
+        watched.update(address.lower() for address in config.get("addresses", []))
+    return watched
+
+def get_indexed_transactions(address, limit=3):
+    """从本地区块索引查询地址的最近交易"""
+    if SHARED_STATE and WORKER_INDEX != 0:
+        # 索引器只在0号工作进程运行，其他进程直接读数据库
+        rows = DB.execute(
+            "SELECT entry FROM indexed_transactions WHERE address = ? ORDER BY block DESC LIMIT ?",
+            (address.lower(), limit)
+        )
+        return [json.loads(entry) for (entry,) in rows]
+    return TX_INDEX["addresses"].get(address.lower(), [])[:limit]
+
+def add_index_entry(address, entry):
+    """写入一条索引记录；同一交易的多条记录合并，列表按区块从新到旧排序"""
+    entries = TX_INDEX["addresses"].setdefault(address, [])
+    DIRTY_TX_INDEX.add(address)
+    for existing in entries:
+        if existing["hash"] != entry["hash"]:
+            continue
+        if "logs" in entry:
+            # 按日志序号去重，同一交易里金额相同的多笔转账也分别累加
+            new_logs = [log for log in entry["logs"] if log not in existing.get("logs", [])]
+            if not new_logs:
+                return
+            existing["logs"] = existing.get("logs", []) + new_logs
+            existing["delta_wei"] = existing.get("delta_wei", 0) + entry["delta_wei"]
+            existing["tokens"] = f"{existing['tokens']} {entry['tokens']}".strip()
+        elif entry["tokens"] and entry["tokens"] not in existing["tokens"]:
+            existing["tokens"] = f"{existing['tokens']} {entry['tokens']}".strip()
+        return
+    entries.append(entry)
+    entries.sort(key=lambda item: item["block"], reverse=True)
+    del entries[INDEXER_TXS_PER_ADDRESS:]
+
+def index_block(block, watched):
+    """把区块中涉及监控地址的交易记录到索引"""
+    block_number = int(block["number"], 16)
+    tx_time = datetime.fromtimestamp(int(block["timestamp"], 16)).strftime("%Y-%m-%d %H:%M:%S")
+    for tx in block["transactions"]:
+        sender = tx["from"].lower()
+        receiver = (tx.get("to") or "").lower()
+        if sender not in watched and receiver not in watched:
+            continue
+        
+        fee = int(tx.get("gasPrice", "0x0"), 16) * int(tx.get("gas", "0x0"), 16)
+        value = Web3.from_wei(int(tx.get("value", "0x0"), 16), 'ether')
+        for address, sign in ((sender, "-"), (receiver, "+")):
+            if address not in watched:
+                continue
+            add_index_entry(address, {
+                "time": tx_time,
+                "hash": tx["hash"],
+                "type": "Transfer",
+                "status": "✅",
+                "fee": str(Web3.from_wei(fee, 'ether')),
+                "tokens": f"{sign}{value} MON" if value else "",
+                "block": block_number
+            })
+
+async def fetch_blocks(block_numbers):
+    """通过JSON-RPC批量请求获取完整区块，返回按区块号排序的连续成功结果"""
+    batches = [block_numbers[i:i + INDEXER_BATCH_SIZE] for i in range(0, len(block_numbers), INDEXER_BATCH_SIZE)]
+    results = await asyncio.gather(
+        *(rpc_batch([("eth_getBlockByNumber", [hex(n), True]) for n in batch]) for batch in batches),
+        return_exceptions=True
+    )
+    
+    blocks = []
+    for batch, batch_result in zip(batches, results):
+        if isinstance(batch_result, Exception):
+            break
+        for block in batch_result:
+            # 遇到失败的区块就停止，下次从这里继续，保证不漏块
+            if isinstance(block, Exception) or block is None:
+                return blocks
+            blocks.append(block)
+    return blocks
+
+def is_range_error(error):
+    """判断eth_getLogs错误是否因为区块范围或结果过多；限流和超时不是范围问题，缩小范围只会放大请求数"""
+    if isinstance(error, (RpcRateLimited, TimeoutError, asyncio.TimeoutError)):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 413
+    message = str(error).lower()
+    return any(hint in message for hint in ("block range", "too many results", "query returned more than", "response size exceeded"))
+
+async def get_logs_range(topics, start, end):
+    """获取区块范围内的42T日志，节点拒绝范围过大时二分后重试"""
+    try:
+        return await rpc_call("eth_getLogs", [{
+            "address": FORTYTWO_TOKEN_ADDRESS,
+            "topics": topics,
+            "fromBlock": hex(start),
+            "toBlock": hex(end)
+        }])
+    except Exception as e:
+        if start == end or not is_range_error(e):
+            raise
+        half = (end - start + 1) // 2
+        LOGS_STATE["chunk_size"] = max(LOGS_MIN_CHUNK_SIZE, min(LOGS_STATE["chunk_size"], half))
+        left, right = await asyncio.gather(
+            get_logs_range(topics, start, start + half - 1),
+            get_logs_range(topics, start + half, end)
+        )
+        return left + right
+
+def decode_transfer(log):
+    """解码ERC20 Transfer日志"""
+    return {
+        "from": "0x" + log["topics"][1][-40:],
+        "to": "0x" + log["topics"][2][-40:],
+        "value": int(log["data"], 16) if log["data"] not in ("0x", "") else 0,
+        "block": int(log["blockNumber"], 16),
+        "log_index": int(log["logIndex"], 16),
+        "hash": log["transactionHash"],
+        "timestamp": int(log["blockTimestamp"], 16) if log.get("blockTimestamp") else None
+    }
+
+async def get_42t_transfers(addresses, from_block, to_block):
+    """用eth_getLogs查询一组地址在区块范围内的所有42T转账，按区块顺序返回"""
+    if from_block > to_block or not addresses:
+        return []
+    
+    padded = ["0x" + address[2:].lower().rjust(64, "0") for address in addresses]
+    chunk_size = LOGS_STATE["chunk_size"]
+    ranges = [(start, min(to_block, start + chunk_size - 1)) for start in range(from_block, to_block + 1, chunk_size)]
+    semaphore = asyncio.Semaphore(LOGS_CONCURRENCY)
+    
+    async def fetch(topics, start, end):
+        async with semaphore:
+            return await get_logs_range(topics, start, end)
+    
+    queries = []
+    for i in range(0, len(padded), LOGS_ADDRESS_BATCH):
+        group = padded[i:i + LOGS_ADDRESS_BATCH]
+        # topic[1]是发送方，topic[2]是接收方，分别查询转出和转入
+        for topics in ([TRANSFER_TOPIC, group], [TRANSFER_TOPIC, None, group]):
+            queries.extend(fetch(topics, start, end) for start, end in ranges)
+    
+    results = await asyncio.gather(*queries)
+    if LOGS_STATE["chunk_size"] == chunk_size:
+        # 本轮没有被拒绝过，逐步放大区块范围，直到恢复初始值
+        LOGS_STATE["chunk_size"] = min(LOGS_CHUNK_SIZE, chunk_size * 2)
+    
+    logs = {}
+    for result in results:
+        for log in result:
+            logs[(log["transactionHash"], log["logIndex"])] = log
+    transfers = [decode_transfer(log) for log in logs.values()]
+    transfers.sort(key=lambda transfer: (transfer["block"], transfer["log_index"]))
+    return transfers
+
+async def get_block_timestamps(block_numbers):
+    """批量获取区块头的时间戳"""
+    block_numbers = sorted(set(block_numbers))
+    if not block_numbers:
+        return {}
+    results = await rpc_batch([("eth_getBlockByNumber", [hex(n), False]) for n in block_numbers])
+    return {
+        n: int(block["timestamp"], 16)
+        for n, block in zip(block_numbers, results)
+        if not isinstance(block, Exception) and block
+    }
+
+async def index_42t_transfers(addresses, from_block, to_block, timestamps=None):
+    """把42T转账写入索引，记录每笔转账的精确数量"""
+    transfers = await get_42t_transfers(addresses, from_block, to_block)
+    timestamps = dict(timestamps or {})
+    missing = [t["block"] for t in transfers if t["timestamp"] is None and t["block"] not in timestamps]
+    if missing:
+        timestamps.update(await get_block_timestamps(missing))
+    
+    watched = {address.lower() for address in addresses}
+    for transfer in transfers:
+        timestamp = transfer["timestamp"] or timestamps.get(transfer["block"])
+        tx_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "Unknown"
+        amount = wei_to_decimal(transfer["value"], token_decimals(T42_ASSET))
+        for address, sign in ((transfer["from"], "-"), (transfer["to"], "+")):
+            if address not in watched:
+                continue
+            add_index_entry(address, {
+                "time": tx_time,
+                "hash": transfer["hash"],
+                "type": "42T Transfer",
+                "status": "✅",
+                "fee": "0",
+                "tokens": f"{sign}{amount} 42T",
+                "delta_wei": transfer["value"] if sign == "+" else -transfer["value"],
+                "logs": [f"{transfer['log_index']}{sign}"],
+                "block": transfer["block"]
+            })
+
+async def run_block_indexer(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：跟随最新区块，把涉及监控地址的交易和42T转账写入本地索引"""
+    watched = get_watched_addresses()
+    if not watched:
+        return
+    
+    try:
+        latest_block = int(await rpc_call("eth_blockNumber", []), 16)
+    except Exception as e:
+        print(f"Block indexer failed to get block number: {e}")
+        return
+    
+    last_block = TX_INDEX.get("last_block")
+    start = last_block + 1 if last_block is not None else max(0, latest_block - INDEXER_BACKFILL_BLOCKS)
+    end = min(latest_block, start + INDEXER_MAX_BLOCKS_PER_TICK - 1)
+    
+    # 新加入的地址先通过日志回溯42T转账，无需下载完整区块
+    new_addresses = sorted(watched - set(TX_INDEX["backfilled"]))
+    if new_addresses:
+        try:
+            await index_42t_transfers(new_addresses, max(0, start - LOGS_LOOKBACK_BLOCKS), start - 1)
+            TX_INDEX["backfilled"].extend(new_addresses)
+        except Exception as e:
+            print(f"Block indexer failed to backfill 42T transfers: {e}")
+    
+    if start <= end:
+        blocks = await fetch_blocks(list(range(start, end + 1)))
+        if blocks:
+            for block in blocks:
+                index_block(block, watched)
+            indexed_end = int(blocks[-1]["number"], 16)
+            timestamps = {int(block["number"], 16): int(block["timestamp"], 16) for block in blocks}
             try:
-                response = requests.get(url, timeout=10)
-                if response.ok:
-                    data = response.json()
-                    
-                    transactions = []
-                    tx_list = data.get("transactions", []) or data.get("data", []) or data.get("result", [])
-                    
-                    for tx in tx_list[:limit]:
-                        timestamp = tx.get("timestamp") or tx.get("time") or tx.get("blockTime")
-                        tx_hash = tx.get("hash") or tx.get("txHash")
-                        
-                        if timestamp and tx_hash:
-                            tx_time = datetime.fromtimestamp(int(timestamp))
-                            transactions.append({
-                                "time": tx_time.strftime("%Y-%m-%d %H:%M:%S"),
-                                "hash": tx_hash,
-                                "type": "Transfer",
-                                "status": "✅",
-                                "fee": "0",
-                                "tokens": ""
-                            })
-                    
-                    if transactions:
-                        return transactions
-                        
+                await index_42t_transfers(sorted(watched), start, indexed_end, timestamps)
+                TX_INDEX["last_block"] = indexed_end
             except Exception as e:
+                # 日志查询失败时不推进进度，下次重新处理这些区块
+                print(f"Block indexer failed to get 42T transfers: {e}")
+    
+    # 清理已不再监控的地址
+    for address in list(TX_INDEX["addresses"]):
+        if address not in watched:
+            del TX_INDEX["addresses"][address]
+            DIRTY_TX_INDEX.add(address)
+    TX_INDEX["backfilled"] = [address for address in TX_INDEX["backfilled"] if address in watched]
+    save_tx_index()
+
+async def fetch_recent_transactions(semaphore, address):
+    """在并发上限内获取单个地址的最近交易"""
+    async with semaphore:
+        return await get_recent_transactions_cached(address)
+
+def format_age(seconds):
+    """将秒数格式化为简短的时长文本"""
+    seconds = max(0, int(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h{seconds % 3600 // 60}m"
+
+def format_report_header(block_number=None, updated=None):
+    """格式化报告头部，updated 为快照中最旧数据的时间戳"""
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    header_msg = f"🪙 <b>FortyTwo Token Monitor</b>\n<b>Time:</b> {current_time}\n"
+    if block_number is not None:
+        header_msg += f"<b>Block:</b> {block_number}\n"
+    if updated is not None:
+        header_msg += f"<b>Data age:</b> {format_age(time.time() - updated)}\n"
+    return header_msg
+
+def format_address_status(address, mon_wei, t42_wei, recent_txs, changes=None, tokens=None, token_changes=None):
+    """格式化地址状态信息，余额和变化量均为整数wei；changes 为空时与上次记录的余额比较，tokens 为额外代币余额"""
+    explorer_link = f"{EXPLORER_URL}/address/{address}?tab=Activity&portfolio=Token"
+    mon_balance, fortytwo_balance = to_display_balances(mon_wei, t42_wei)
+    
+    # 获取余额变化
+    if changes is None:
+        changes = get_balance_change(address, mon_wei, t42_wei)
+    mon_change, t42_change = changes
+    
+    msg = (
+        f"<b>Address:</b> <code>{address}</code>\n"
+        f"<b>MON Balance:</b> {mon_balance} MON"
+    )
+    
+    # 添加MON余额变化指示器
+    if mon_change:
+        change_symbol = "📈" if mon_change > 0 else "📉"
+        msg += f" {change_symbol} ({format_wei_delta(mon_change)})"
+    
+    msg += f"\n<b>42T Balance:</b> {fortytwo_balance} 42T"
+    
+    # 添加42T余额变化指示器
+    if t42_change:
+        change_symbol = "📈" if t42_change > 0 else "📉"
+        msg += f" {change_symbol} ({format_wei_delta(t42_change, token_decimals(T42_ASSET))})"
+    
+    # 额外监控的代币
+    token_changes = token_changes or {}
+    for token, balance in (tokens or {}).items():
+        symbol = html.escape(token_symbol(token))
+        amount = wei_to_decimal(balance, token_decimals(token)) if balance is not None else "Error"
+        msg += f"\n<b>{symbol} Balance:</b> {amount} {symbol}"
+        if token_changes.get(token):
+            change_symbol = "📈" if token_changes[token] > 0 else "📉"
+            msg += f" {change_symbol} ({format_wei_delta(token_changes[token], token_decimals(token))})"
+    
+    # 添加活跃状态指示器
+    if mon_change or t42_change or any(token_changes.values()):
+        msg += "\n🟢 <b>ACTIVE - 余额有变化</b>"
+    
+    if recent_txs:
+        msg += "\n\n<b>Recent Transactions:</b>\n"
+        for i, tx in enumerate(recent_txs, 1):
+            msg += f"{i}. {tx['time']}\n"
+            msg += f"   <code>{tx['hash'][:10]}...</code>\n"
+    else:
+        msg += "\n\n<b>Recent Transactions:</b> No recent activity\n"
+    
+    msg += f'\n<a href="{explorer_link}">View on Explorer</a>'
+    return msg
+
+def snapshot_interval(key, now):
+    """根据地址最近一次被查看或余额变化的时间计算刷新间隔，越久不活跃刷新越慢"""
+    snapshot = SNAPSHOTS.get(key)
+    last_active = max(SNAPSHOT_VIEWS.get(key, 0), snapshot["changed_at"] if snapshot else 0)
+    idle = now - last_active
+    return min(SNAPSHOT_MAX_REFRESH, max(SNAPSHOT_MIN_REFRESH, idle * SNAPSHOT_IDLE_FACTOR))
+
+def update_snapshot(address, holdings, recent_txs, block_number, now):
+    """用最新数据更新单个地址的快照，并预先生成不含额外代币的HTML片段；holdings 为 (MON wei, 42T wei, {代币: wei})"""
+    key = address.lower()
+    previous = SNAPSHOTS.get(key)
+    mon_wei, t42_wei, tokens = holdings
+    if previous is not None and (mon_wei is None or t42_wei is None):
+        # 读取失败时保留旧快照，稍后重试
+        previous["next_refresh"] = now + SNAPSHOT_MIN_REFRESH
+        return previous
+    
+    if recent_txs is None and previous is not None:
+        # 交易记录数据源暂时不可用时沿用上次的记录
+        recent_txs = previous["recent_txs"]
+    changes = get_balance_change(address, mon_wei, t42_wei)
+    previous_tokens = previous["tokens"] if previous else {}
+    token_changes = {
+        token: balance - previous_tokens[token]
+        for token, balance in tokens.items()
+        if balance is not None and previous_tokens.get(token) is not None
+    }
+    changed_at = previous["changed_at"] if previous else 0
+    if any(changes) or any(token_changes.values()):
+        changed_at = now
+    elif previous is not None and now - changed_at < SNAPSHOT_ACTIVE_WINDOW:
+        # 变化指示在窗口期内保持显示，不会被下一次无变化的刷新覆盖
+        changes = previous["changes"]
+        token_changes = previous["token_changes"]
+    
+    snapshot = {
+        "address": address,
+        "mon_wei": mon_wei,
+        "t42_wei": t42_wei,
+        "tokens": tokens,
+        "changes": changes,
+        "token_changes": token_changes,
+        "recent_txs": recent_txs,
+        "block": block_number,
+        "updated": now,
+        "changed_at": changed_at,
+        "html": format_address_status(address, mon_wei, t42_wei, recent_txs, changes)
+    }
+    if mon_wei is None or t42_wei is None:
+        # 首次读取就失败时只用于本次显示，不缓存，下次查看或刷新时重新查询
+        snapshot["next_refresh"] = now + SNAPSHOT_MIN_REFRESH
+        return snapshot
+    SNAPSHOTS[key] = snapshot
+    snapshot["next_refresh"] = now + snapshot_interval(key, now)
+    return snapshot
+
+async def refresh_snapshots(addresses):
+    """刷新一组地址的快照：所有资产余额一次批量读取，交易记录并发查询，返回区块号"""
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    (holdings, block_number), activities = await asyncio.gather(
+        get_holdings_cached(addresses),
+        asyncio.gather(*(fetch_recent_transactions(semaphore, address) for address in addresses))
+    )
+    
+    now = time.time()
+    snapshots = [
+        update_snapshot(address, holdings[address], recent_txs, block_number, now)
+        for address, recent_txs in zip(addresses, activities)
+    ]
+    save_report_snapshots(snapshots)
+    if SHARED_STATE:
+        flush_balance_history()
+    return block_number
+
+def is_snapshot_stale(address, now, tokens=()):
+    """快照不存在、余额读取失败、超过最长有效期或缺少 tokens 中的代币余额时需要实时查询"""
+    key = address.lower()
+    snapshot = SNAPSHOTS.get(key)
+    return (
+        snapshot is None
+        or snapshot["mon_wei"] is None
+        or snapshot["t42_wei"] is None
+        or now - snapshot["updated"] > SNAPSHOT_MAX_AGE
+        or any(token not in snapshot["tokens"] for token in tokens)
+    )
+
+def get_report_tokens(user_id, address):
+    """报告中显示的额外代币：只显示该用户为自己监控的地址配置的代币"""
+    if address.lower() not in {a.lower() for a in get_user_addresses(user_id)}:
+        return []
+    return get_user_tokens(user_id, address)
+
+def format_snapshot(snapshot, tokens):
+    """按查看用户监控的代币生成快照的HTML，没有额外代币时直接使用预先生成的片段"""
+    if not tokens:
+        return snapshot["html"]
+    return format_address_status(
+        snapshot["address"], snapshot["mon_wei"], snapshot["t42_wei"], snapshot["recent_txs"], snapshot["changes"],
+        {token: snapshot["tokens"].get(token) for token in tokens},
+        {token: change for token, change in snapshot["token_changes"].items() if token in tokens}
+    )
+
+async def iter_report_snapshots(addresses, fresh=False, tokens=None):
+    """按地址顺序分批产出快照：每批是当前已就绪的连续地址，其余地址等数据到达后再产出；tokens 为 小写地址 -> 需要显示的额外代币"""
+    now = time.time()
+    if SHARED_STATE:
+        # 其他工作进程刷新的快照可以直接使用，查看时间写回数据库供负责刷新的进程参考
+        sync_report_snapshots()
+        mark_snapshots_viewed([address.lower() for address in addresses], now)
+    for address in addresses:
+        key = address.lower()
+        SNAPSHOT_VIEWS[key] = now
+        snapshot = SNAPSHOTS.get(key)
+        if snapshot is not None:
+            # 被查看的地址立即回到高频刷新
+            snapshot["next_refresh"] = min(snapshot["next_refresh"], now + SNAPSHOT_MIN_REFRESH)
+    
+    if fresh:
+        for address, asset in plan_holdings(addresses):
+            BALANCE_CACHE.discard((address.lower(), asset))
+        for address in addresses:
+            ACTIVITY_CACHE.discard((address.lower(), 3))
+        stale = list(addresses)
+    else:
+        tokens = tokens or {}
+        stale = [address for address in addresses if is_snapshot_stale(address, now, tokens.get(address.lower(), ()))]
+    
+    # 需要实时查询的地址：所有资产余额一次批量读取，交易记录各自并发查询
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    balance_task = asyncio.ensure_future(get_holdings_cached(stale)) if stale else None
+    activity_tasks = {
+        address.lower(): asyncio.ensure_future(fetch_recent_transactions(semaphore, address))
+        for address in stale
+    }
+    refreshed = []
+    try:
+        batch = []
+        for address in addresses:
+            key = address.lower()
+            task = activity_tasks.get(key)
+            if task is None:
+                batch.append(SNAPSHOTS[key])
+                continue
+            if batch and not (balance_task.done() and task.done()):
+                yield batch
+                batch = []
+            holdings, block_number = await balance_task
+            recent_txs = await task
+            snapshot = update_snapshot(address, holdings[address], recent_txs, block_number, time.time())
+            refreshed.append(snapshot)
+            batch.append(snapshot)
+        if batch:
+            yield batch
+    finally:
+        tasks = [task for task in (balance_task, *activity_tasks.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        save_report_snapshots(refreshed)
+        if SHARED_STATE:
+            flush_balance_history()
+
+def format_snapshot_header(snapshots):
+    """用已发送快照中最旧的区块号和数据时间生成报告头部"""
+    blocks = [snapshot["block"] for snapshot in snapshots if snapshot["block"] is not None]
+    return format_report_header(min(blocks) if blocks else None, min(snapshot["updated"] for snapshot in snapshots))
+
+async def refresh_snapshots_job(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：按自适应间隔刷新到期地址的报告快照，多进程时每个进程只刷新分给自己的地址"""
+    sync_shared_state()
+    if SHARED_STATE:
+        sync_report_snapshots()
+    now = time.time()
+    watched = get_watched_addresses()
+    
+    # 清理不再监控且长时间没有被查看的地址
+    for key in list(SNAPSHOT_VIEWS):
+        if key not in watched and now - SNAPSHOT_VIEWS[key] > SNAPSHOT_MAX_AGE:
+            del SNAPSHOT_VIEWS[key]
+    for key in list(SNAPSHOTS):
+        if key not in watched and key not in SNAPSHOT_VIEWS:
+            del SNAPSHOTS[key]
+    
+    due = []
+    for key in watched | SNAPSHOTS.keys():
+        if not owns_address(key):
+            continue
+        snapshot = SNAPSHOTS.get(key)
+        if snapshot is None:
+            due.append(Web3.to_checksum_address(key))
+        elif snapshot["next_refresh"] <= now:
+            due.append(snapshot["address"])
+    if due:
+        await refresh_snapshots(due)
+
+class OutboxJob:
+    """发送队列中的一条待发送或待编辑的消息"""
+    
+    def __init__(self, kind, chat_id, text, kwargs, message_id=None, merge=False):
+        self.kind = kind  # "send" 或 "edit"
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.message_id = message_id
+        self.merge = merge  # 是否允许与同一聊天相邻的待发消息合并
+        self.waiters = []  # (future, 入队时间)，合并后的每个调用方都拿到同一个结果
+
+class TelegramOutbox:
+    """所有发往Telegram的消息统一排队：限制全局和单个聊天的发送速率，合并同一聊天的待发消息，RetryAfter只暂停对应聊天"""
+    
+    def __init__(self, global_rate, chat_interval):
+        self.bot = None
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.queues = {}  # chat_id -> 待发送任务队列
+        self.ready_at = {}  # chat_id -> 该聊天下次允许发送的时间
+        self.busy = set()  # 正在发送中的聊天，同一聊天同时只发一条
+        self.tokens = global_rate
+        self.refilled_at = time.monotonic()
+        self.wakeup = None
+        self.worker = None
+        self.deliveries = set()
+        self.latencies = deque(maxlen=1000)  # 从入队到发送完成的耗时（秒）
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+        self.failed = 0
+    
+    def start(self, bot):
+        self.bot = bot
+        self.wakeup = asyncio.Event()
+        self.worker = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        tasks = [task for task in (self.worker, *self.deliveries) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.worker = None
+        for queue in self.queues.values():
+            for job in queue:
+                for future, _ in job.waiters:
+                    future.cancel()
+        self.queues.clear()
+    
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+    
+    def stats(self):
+        ordered = sorted(self.latencies)
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000) if ordered else None
+        return {
+            "depth": self.depth(),
+            "chats": len(self.queues),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99)
+        }
+    
+    async def send(self, chat_id, text, merge=False, **kwargs):
+        """排队发送新消息，返回发送后的Message"""
+        return await self._enqueue(OutboxJob("send", chat_id, text, kwargs, merge=merge))
+    
+    def post(self, chat_id, text, merge=False, **kwargs):
+        """排队发送新消息但不等待发送完成，返回发送结果的Future"""
+        return self._enqueue(OutboxJob("send", chat_id, text, kwargs, merge=merge))
+    
+    async def edit(self, message, text, **kwargs):
+        """排队编辑已发送的消息；同一消息尚未发出的旧编辑会被新内容替换"""
+        return await self._enqueue(OutboxJob("edit", message.chat_id, text, kwargs, message_id=message.message_id))
+    
+    def _absorb(self, queue, job):
+        """尝试把新任务并入队列中已有的任务"""
+        if job.kind == "edit":
+            for pending in queue:
+                if pending.kind == "edit" and pending.message_id == job.message_id:
+                    pending.text = job.text
+                    pending.kwargs = job.kwargs
+                    return pending
+            return None
+        # 只与队尾合并，保证同一聊天的消息顺序不变
+        if queue and job.merge:
+            pending = queue[-1]
+            if (pending.kind == "send" and pending.merge and pending.kwargs == job.kwargs
+                    and len(pending.text) + 2 + len(job.text) <= TELEGRAM_MESSAGE_LIMIT):
+                pending.text += "\n\n" + job.text
+                return pending
+        return None
+    
+    def _enqueue(self, job):
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(job.chat_id, deque())
+        pending = self._absorb(queue, job)
+        if pending is not None:
+            self.merged += 1
+        else:
+            pending = job
+            queue.append(job)
+        pending.waiters.append((future, time.monotonic()))
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return future
+    
+    def _next_chat(self, now):
+        """选出可以发送的聊天（最早入队的优先），以及没有可发送聊天时需要等待的时间"""
+        chosen = None
+        wait = None
+        for chat_id, queue in self.queues.items():
+            if chat_id in self.busy:
+                continue
+            ready = self.ready_at.get(chat_id, 0.0)
+            if ready > now:
+                wait = ready - now if wait is None else min(wait, ready - now)
+            elif chosen is None or queue[0].waiters[0][1] < self.queues[chosen][0].waiters[0][1]:
+                chosen = chat_id
+        return chosen, wait
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.global_rate, self.tokens + (now - self.refilled_at) * self.global_rate)
+        self.refilled_at = now
+    
+    async def _acquire(self):
+        """全局令牌桶限速，令牌不足时等待"""
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.global_rate)
+            self._refill()
+        self.tokens -= 1
+    
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            chat_id, wait = self._next_chat(time.monotonic())
+            if chat_id is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
                 continue
-        
-        # 备用方法2：直接从区块链获取
-        try:
-            w3 = Web3(Web3.HTTPProvider(MONAD_RPC))
-            if w3.is_connected():
-                nonce = w3.eth.get_transaction_count(address)
-                if nonce > 0:
-                    latest_block = w3.eth.block_number
-                    for block_num in range(latest_block, max(0, latest_block - 100), -1):
-                        try:
-                            block = w3.eth.get_block(block_num, full_transactions=True)
-                            for tx in block.transactions:
-                                if tx['from'].lower() == address.lower() or (tx['to'] and tx['to'].lower() == address.lower()):
-                                    tx_time = datetime.fromtimestamp(block.timestamp)
-                                    return [{
-                                        "time": tx_time.strftime("%Y-%m-%d %H:%M:%S"),
-                                        "hash": tx['hash'].hex(),
-                                        "type": "Transfer",
-                                        "status": "✅",
-                                        "fee": str(w3.from_wei(tx.get('gasPrice', 0) * tx.get('gas', 0), 'ether')),
-                                        "tokens": ""
-                                    }]
-                        except:
-                            continue
-        except:
-            pass
             
-        return []
-        
-    except Exception as e:
-        print(f"Error getting transactions: {e}")
-        return []
-
-def format_address_status(address, mon_balance, fortytwo_balance, recent_txs):
-    """格式化地址状态信息"""
-    explorer_link = f"https://testnet.monadexplorer.com/address/{address}?tab=Activity&portfolio=Token"
+            await self._acquire()
+            queue = self.queues[chat_id]
+            job = queue.popleft()
+            if not queue:
+                del self.queues[chat_id]
+            self.busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(job))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
     
-    # 获取余额变化
-    mon_change, t42_change = get_balance_change(address, mon_balance, fortytwo_balance)
+    async def _deliver(self, job):
+        try:
+            with METRICS.timer("fortytwo_upstream_seconds", upstream="telegram", target=job.kind):
+                if job.kind == "send":
+                    result = await self.bot.send_message(chat_id=job.chat_id, text=job.text, **job.kwargs)
+                else:
+                    result = await self.bot.edit_message_text(job.text, chat_id=job.chat_id, message_id=job.message_id, **job.kwargs)
+        except RetryAfter as e:
+            # 只暂停这个聊天，放回队首等待后重发
+            delay = e.retry_after
+            delay = delay.total_seconds() if isinstance(delay, timedelta) else delay
+            self.retry_after += 1
+            self.ready_at[job.chat_id] = time.monotonic() + delay
+            self.queues.setdefault(job.chat_id, deque()).appendleft(job)
+            print(f"Telegram flood control for chat {job.chat_id}, retrying in {delay}s")
+            return
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                self._finish(job, error=e)
+                return
+            result = None
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        finally:
+            self.busy.discard(job.chat_id)
+            self.wakeup.set()
+        self.ready_at[job.chat_id] = time.monotonic() + self.chat_interval
+        self._finish(job, result=result)
     
-    msg = (
-        f"<b>Address:</b> <code>{address}</code>\n"
-        f"<b>MON Balance:</b> {mon_balance} MON"
-    )
+    def _finish(self, job, result=None, error=None):
+        now = time.monotonic()
+        if error is not None:
+            self.failed += 1
+        else:
+            self.sent += 1
+        for future, enqueued in job.waiters:
+            self.latencies.append(now - enqueued)
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                future.exception()  # 调用方已取消时避免 "exception was never retrieved" 警告
+            else:
+                future.set_result(result)
+
+OUTBOX = TelegramOutbox(TELEGRAM_GLOBAL_RATE / WORKER_COUNT, TELEGRAM_CHAT_INTERVAL)  # 多进程时各工作进程平分全局限速
+
+async def reply(update: Update, text, **kwargs):
+    """通过发送队列回复当前聊天"""
+    return await OUTBOX.send(update.effective_chat.id, text, **kwargs)
+
+class ReportStream:
+    """流式发送报告：按地址边界分页，每页先发送再随结果到达编辑，同一聊天内的发送和编辑限速"""
     
-    # 添加MON余额变化指示器
-    if mon_change is not None and mon_change != 0:
-        change_symbol = "📈" if mon_change > 0 else "📉"
-        change_text = f" (+{mon_change:.6f})" if mon_change > 0 else f" ({mon_change:.6f})"
-        msg += f" {change_symbol}{change_text}"
+    def __init__(self, update, status_msg=None):
+        self.update = update
+        self.message = status_msg  # 当前页对应的消息，为空时下次发送新消息
+        self.header = ""  # 只显示在第一页
+        self.parts = []  # 当前页的地址片段
+        self.pages = 0  # 已完成的页数
+        self.sent_text = None  # 当前页最后一次发出的内容
+        self.last_sent = time.monotonic() if status_msg is not None else 0.0
     
-    msg += f"\n<b>42T Balance:</b> {fortytwo_balance} 42T"
+    def render(self):
+        body = REPORT_SEPARATOR.join(self.parts)
+        if self.pages == 0 and self.header:
+            return self.header + "\n" + body
+        return body
     
-    # 添加42T余额变化指示器
-    if t42_change is not None and t42_change != 0:
-        change_symbol = "📈" if t42_change > 0 else "📉"
-        change_text = f" (+{t42_change:.6f})" if t42_change > 0 else f" ({t42_change:.6f})"
-        msg += f" {change_symbol}{change_text}"
+    async def add(self, part):
+        """追加一个地址的片段，当前页放不下时先完成当前页再开始新的一页"""
+        if self.parts and len(self.render() + REPORT_SEPARATOR + part) > REPORT_PAGE_LIMIT:
+            await self.flush(force=True)
+            self.pages += 1
+            self.parts = []
+            self.message = None
+            self.sent_text = None
+        self.parts.append(part)
     
-    # 添加活跃状态指示器
-    is_active = (mon_change is not None and mon_change != 0) or (t42_change is not None and t42_change != 0)
-    if is_active:
-        msg += "\n🟢 <b>ACTIVE - 余额有变化</b>"
+    async def flush(self, force=False):
+        """发送当前页的最新内容；距上次发送不足间隔时，非强制刷新直接跳过，强制刷新由发送队列按聊天间隔排队"""
+        text = self.render()
+        if text == self.sent_text:
+            return
+        if not force and time.monotonic() - self.last_sent < REPORT_EDIT_INTERVAL:
+            return
+        if self.message is None:
+            self.message = await reply(self.update, text, parse_mode='HTML', disable_web_page_preview=True)
+        else:
+            await OUTBOX.edit(self.message, text, parse_mode='HTML', disable_web_page_preview=True)
+        self.sent_text = text
+        self.last_sent = time.monotonic()
     
-    if recent_txs:
-        msg += "\n\n<b>Recent Transactions:</b>\n"
-        for i, tx in enumerate(recent_txs, 1):
-            msg += f"{i}. {tx['time']}\n"
-            msg += f"   <code>{tx['hash'][:10]}...</code>\n"
-    else:
-        msg += "\n\n<b>Recent Transactions:</b> No recent activity\n"
+    async def fail(self, text):
+        """用错误信息替换当前页"""
+        self.header = ""
+        self.parts = [text]
+        await self.flush(force=True)
+
+async def stream_report(update: Update, addresses, fresh, status_text):
+    """按地址顺序流式发送报告，额外代币只显示查看用户自己监控的；快照都可用时直接发送，否则先显示查询提示"""
+    user_id = str(update.effective_user.id)
+    tokens = {address.lower(): get_report_tokens(user_id, address) for address in addresses}
+    status_msg = None
+    now = time.time()
+    if fresh or any(is_snapshot_stale(address, now, tokens[address.lower()]) for address in addresses):
+        status_msg = await reply(update, status_text)
+    stream = ReportStream(update, status_msg)
     
-    msg += f'\n<a href="{explorer_link}">View on Explorer</a>'
-    return msg
+    try:
+        snapshots = []
+        async for batch in iter_report_snapshots(addresses, fresh, tokens):
+            if not snapshots and batch[0]["block"] is None and not RPC_STATUS["healthy"]:
+                await stream.fail("❌ 无法连接到Monad网络")
+                return
+            snapshots.extend(batch)
+            stream.header = format_snapshot_header(snapshots)
+            for snapshot in batch:
+                await stream.add(format_snapshot(snapshot, tokens[snapshot["address"].lower()]))
+            await stream.flush()
+        await stream.flush(force=True)
+        
+    except Exception as e:
+        error_msg = f"❌ 查询过程中出现错误：\n<code>{html.escape(str(e))}</code>"
+        await stream.fail(error_msg)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /start 命令"""
@@ -264,25 +2615,41 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🪙 FortyTwo Token Monitor Bot\n\n"
         "欢迎使用FortyTwo代币监控机器人！\n\n"
         "可用命令：\n"
-        "/check - 检查默认地址列表的代币余额\n"
+        "/check - 检查默认地址列表的代币余额（/check fresh 强制实时查询）\n"
         "/check_address <code>address</code> - 检查指定地址的代币余额\n"
         "/add_address <code>address</code> - 添加地址到监控列表\n"
+        "/add_addresses <code>address1 address2 ...</code> - 批量添加地址\n"
         "/list_addresses - 查看监控地址列表\n"
+        "/watch - 余额变化时自动推送通知\n"
         "/help - 显示帮助信息\n\n"
         "使用 /check 开始查询代币余额！"
     )
-    await update.message.reply_text(welcome_msg, parse_mode='HTML')
+    await reply(update, welcome_msg, parse_mode='HTML')
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /help 命令"""
     help_msg = (
         "🪙 <b>FortyTwo Token Monitor Bot - 帮助</b>\n\n"
         "<b>命令说明：</b>\n"
-        "• /check - 检查所有默认地址的代币余额\n"
+        "• /check [fresh] - 检查所有地址的代币余额，默认使用后台预先刷新的数据，fresh 强制实时查询\n"
         "• /check_address <code>address</code> - 检查单个地址\n"
         "• /add_address <code>address</code> - 添加监控地址\n"
+        "• /add_addresses <code>address1 address2 ...</code> - 批量添加地址（也可发送文件并在说明中填写 /add_addresses）\n"
+        "• /remove_addresses <code>address1 address2 ...</code> - 批量删除地址\n"
         "• /list_addresses - 查看监控列表\n"
+        "• /add_token <code>token</code> [address] - 额外监控ERC20代币，不指定地址时对所有地址生效\n"
+        "• /remove_token <code>token</code> [address] - 取消监控代币\n"
+        "• /history <code>address</code> [24h] - 查看余额历史\n"
+        "• /earnings [24h] - 统计所有地址的42T收益\n"
+        "• /summary [24h] - 汇总余额合计、变化和涨跌最多的地址\n"
+        "• /watch - 开启余额变化推送\n"
+        "• /unwatch - 关闭余额变化推送\n"
         "• /clear_history - 清除余额历史记录\n"
+        "• /cache_stats - 查看缓存命中统计\n"
+        "• /queue_stats - 查看消息发送队列统计\n"
+        "• /rpc_status - 查看RPC节点状态\n"
+        "• /stats - 查看命令和上游接口的延迟统计（管理员）\n"
+        "• /profile on|off|status - 开关采样分析器（管理员）\n"
         "• /help - 显示此帮助信息\n\n"
         "<b>余额变化指示器：</b>\n"
         "📈 - 余额增加\n"
@@ -291,124 +2658,179 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>示例：</b>\n"
         "/check_address <code>0x2B0257e1302F2c3e0677956d0EA3F28d84919884</code>"
     )
-    await update.message.reply_text(help_msg, parse_mode='HTML')
+    await reply(update, help_msg, parse_mode='HTML')
 
 async def check_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /check 命令 - 检查所有地址"""
     user_id = str(update.effective_user.id)
-    addresses = USER_CONFIGS.get(user_id, {}).get("addresses", DEFAULT_ADDRESSES)
+    addresses = get_user_addresses(user_id)
     
     if not addresses:
-        await update.message.reply_text("❌ 没有配置监控地址，请使用 /add_address 添加地址")
+        await reply(update, "❌ 没有配置监控地址，请使用 /add_address 添加地址")
         return
     
-    status_msg = await update.message.reply_text("🔍 正在查询代币余额，请稍候...")
-    
-    try:
-        w3 = Web3(Web3.HTTPProvider(MONAD_RPC))
-        if not w3.is_connected():
-            await status_msg.edit_text("❌ 无法连接到Monad网络")
-            return
-        
-        messages = []
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        header_msg = f"🪙 <b>FortyTwo Token Monitor</b>\n<b>Time:</b> {current_time}\n"
-        messages.append(header_msg)
-        
-        for i, address in enumerate(addresses, 1):
-            mon_balance = get_token_balance(w3, address)
-            fortytwo_balance = get_token_balance(w3, address, FORTYTWO_TOKEN_ADDRESS)
-            recent_txs = get_recent_transactions(address)
-            
-            msg = format_address_status(address, mon_balance, fortytwo_balance, recent_txs)
-            messages.append(msg)
-            
-            if i < len(addresses):
-                messages.append("─" * 50)
-        
-        full_message = "\n\n".join(messages)
-        
-        if len(full_message) > 4096:
-            chunks = [full_message[i:i+4096] for i in range(0, len(full_message), 4096)]
-            for i, chunk in enumerate(chunks):
-                if i == 0:
-                    await status_msg.edit_text(chunk, parse_mode='HTML', disable_web_page_preview=True)
-                else:
-                    await update.message.reply_text(chunk, parse_mode='HTML', disable_web_page_preview=True)
-        else:
-            await status_msg.edit_text(full_message, parse_mode='HTML', disable_web_page_preview=True)
-            
-    except Exception as e:
-        error_msg = f"❌ 查询过程中出现错误：\n<code>{str(e)}</code>"
-        await status_msg.edit_text(error_msg, parse_mode='HTML')
+    fresh = bool(context.args) and context.args[0].lower() == "fresh"
+    await stream_report(update, addresses, fresh, "🔍 正在查询代币余额，请稍候...")
 
 async def check_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /check_address 命令"""
     if not context.args:
-        await update.message.reply_text("❌ 请提供地址：\n/check_address <address>")
+        await reply(update, "❌ 请提供地址：\n/check_address <address>")
         return
     
     address = context.args[0]
     
     if not Web3.is_address(address):
-        await update.message.reply_text("❌ 无效的地址格式")
+        await reply(update, "❌ 无效的地址格式")
         return
     
-    status_msg = await update.message.reply_text(f"🔍 正在查询地址 {address} 的代币余额...")
+    address = Web3.to_checksum_address(address)
+    fresh = len(context.args) > 1 and context.args[1].lower() == "fresh"
+    await stream_report(update, [address], fresh, f"🔍 正在查询地址 {address} 的代币余额...")
+
+ADDRESS_TOKEN_PATTERN = re.compile(r"[\s,;]+")
+
+def parse_address_list(text):
+    """批量校验地址，返回 (校验和地址列表, 无效条目列表)，保持原有顺序"""
+    valid = []
+    invalid = []
+    for token in ADDRESS_TOKEN_PATTERN.split(text):
+        if not token:
+            continue
+        if Web3.is_address(token):
+            valid.append(Web3.to_checksum_address(token))
+        else:
+            invalid.append(token)
+    return valid, invalid
+
+def add_user_addresses(user_id, addresses):
+    """用集合索引去重后追加地址，只写一次数据库，返回 (新增列表, 重复数量)"""
+    config = USER_CONFIGS.setdefault(user_id, {"addresses": []})
+    index = USER_ADDRESS_INDEX.setdefault(user_id, set())
+    added = []
+    for address in addresses:
+        key = address.lower()
+        if key in index:
+            continue
+        index.add(key)
+        added.append(address)
     
-    try:
-        w3 = Web3(Web3.HTTPProvider(MONAD_RPC))
-        if not w3.is_connected():
-            await status_msg.edit_text("❌ 无法连接到Monad网络")
-            return
-        
-        mon_balance = get_token_balance(w3, address)
-        fortytwo_balance = get_token_balance(w3, address, FORTYTWO_TOKEN_ADDRESS)
-        recent_txs = get_recent_transactions(address)
-        
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        header_msg = f"🪙 <b>FortyTwo Token Monitor</b>\n<b>Time:</b> {current_time}\n"
-        
-        full_message = header_msg + "\n" + format_address_status(address, mon_balance, fortytwo_balance, recent_txs)
-        
-        await status_msg.edit_text(full_message, parse_mode='HTML', disable_web_page_preview=True)
-        
-    except Exception as e:
-        error_msg = f"❌ 查询过程中出现错误：\n<code>{str(e)}</code>"
-        await status_msg.edit_text(error_msg, parse_mode='HTML')
+    if added:
+        config["addresses"].extend(added)
+        save_user_addresses(user_id, added)
+        rebuild_token_index()
+    return added, len(addresses) - len(added)
+
+def remove_user_addresses(user_id, addresses):
+    """从用户监控列表中删除地址，只写一次数据库，返回删除的数量"""
+    index = USER_ADDRESS_INDEX.get(user_id, set())
+    targets = {address.lower() for address in addresses} & index
+    if not targets:
+        return 0
+    
+    index -= targets
+    config = USER_CONFIGS[user_id]
+    config["addresses"] = [address for address in config["addresses"] if address.lower() not in targets]
+    delete_user_addresses(user_id, targets)
+    rebuild_token_index()
+    return len(targets)
+
+def format_import_result(added, duplicates, invalid):
+    """格式化批量导入结果"""
+    msg = f"✅ 已添加 {len(added)} 个地址到监控列表"
+    if duplicates:
+        msg += f"\n⚠️ 跳过 {duplicates} 个已存在的地址"
+    if invalid:
+        shown = ", ".join(f"<code>{html.escape(token[:50])}</code>" for token in invalid[:10])
+        more = f" 等 {len(invalid)} 个" if len(invalid) > 10 else ""
+        msg += f"\n❌ 无效条目：{shown}{more}"
+    return msg
+
+async def import_addresses(update: Update, user_id, text):
+    """校验并导入一段文本中的所有地址"""
+    addresses, invalid = parse_address_list(text)
+    if not addresses and not invalid:
+        await reply(update, "❌ 没有找到地址")
+        return
+    if len(addresses) > BULK_IMPORT_LIMIT:
+        await reply(update, f"❌ 单次最多导入 {BULK_IMPORT_LIMIT} 个地址")
+        return
+    
+    added, duplicates = add_user_addresses(user_id, addresses)
+    await reply(update, format_import_result(added, duplicates, invalid), parse_mode='HTML')
 
 async def add_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /add_address 命令"""
     if not context.args:
-        await update.message.reply_text("❌ 请提供地址：\n/add_address <address>")
+        await reply(update, "❌ 请提供地址：\n/add_address <address>")
         return
     
     address = context.args[0]
     user_id = str(update.effective_user.id)
     
     if not Web3.is_address(address):
-        await update.message.reply_text("❌ 无效的地址格式")
+        await reply(update, "❌ 无效的地址格式")
+        return
+    
+    added, _ = add_user_addresses(user_id, [Web3.to_checksum_address(address)])
+    if not added:
+        await reply(update, "⚠️ 该地址已在监控列表中")
+        return
+    
+    await reply(update, f"✅ 已添加地址到监控列表：\n<code>{added[0]}</code>", parse_mode='HTML')
+
+async def add_addresses(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /add_addresses 命令 - 批量添加地址（空格、逗号或换行分隔）"""
+    if not context.args:
+        await reply(
+            update,
+            "❌ 请提供地址，用空格、逗号或换行分隔：\n/add_addresses <address1> <address2> ...\n\n"
+            "也可以发送 .txt / .csv 文件，并在文件说明中填写 /add_addresses"
+        )
         return
     
-    if user_id not in USER_CONFIGS:
-        USER_CONFIGS[user_id] = {"addresses": []}
+    await import_addresses(update, str(update.effective_user.id), " ".join(context.args))
+
+async def add_addresses_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理带 /add_addresses 说明的文件 - 从文件批量导入地址"""
+    document = update.message.document
+    if document.file_size and document.file_size > BULK_IMPORT_MAX_FILE_SIZE:
+        await reply(update, "❌ 文件过大，最大支持1MB")
+        return
+    
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    try:
+        text = bytes(data).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await reply(update, "❌ 文件必须是UTF-8编码的文本")
+        return
     
-    if address in USER_CONFIGS[user_id]["addresses"]:
-        await update.message.reply_text("⚠️ 该地址已在监控列表中")
+    await import_addresses(update, str(update.effective_user.id), text)
+
+async def remove_addresses(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /remove_addresses 命令 - 批量删除地址"""
+    if not context.args:
+        await reply(update, "❌ 请提供要删除的地址：\n/remove_addresses <address1> <address2> ...")
         return
     
-    USER_CONFIGS[user_id]["addresses"].append(address)
-    save_user_configs()
+    user_id = str(update.effective_user.id)
+    addresses, invalid = parse_address_list(" ".join(context.args))
+    removed = remove_user_addresses(user_id, addresses)
     
-    await update.message.reply_text(f"✅ 已添加地址到监控列表：\n<code>{address}</code>", parse_mode='HTML')
+    msg = f"🗑 已从监控列表删除 {removed} 个地址"
+    if len(addresses) > removed:
+        msg += f"\n⚠️ {len(addresses) - removed} 个地址不在监控列表中"
+    if invalid:
+        msg += f"\n❌ {len(invalid)} 个无效条目"
+    await reply(update, msg)
 
 async def list_addresses(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /list_addresses 命令"""
     user_id = str(update.effective_user.id)
     
     if user_id not in USER_CONFIGS or not USER_CONFIGS[user_id].get("addresses"):
-        await update.message.reply_text("📝 你的监控列表为空，将使用默认地址列表")
+        await reply(update, "📝 你的监控列表为空，将使用默认地址列表")
         return
     
     addresses = USER_CONFIGS[user_id]["addresses"]
@@ -417,47 +2839,679 @@ async def list_addresses(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for i, address in enumerate(addresses, 1):
         msg += f"{i}. <code>{address}</code>\n"
     
-    await update.message.reply_text(msg, parse_mode='HTML')
+    tokens = USER_CONFIGS[user_id].get("tokens", [])
+    if tokens:
+        msg += "\n🪙 <b>额外监控的代币：</b>\n"
+        for token, scope in tokens:
+            target = f"<code>{scope[:10]}...</code>" if scope else "所有地址"
+            msg += f"• {html.escape(token_symbol(token))} <code>{token}</code> → {target}\n"
+    
+    await reply(update, msg, parse_mode='HTML')
 
-async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """处理 /clear_history 命令"""
-    global BALANCE_HISTORY
-    BALANCE_HISTORY = {}
-    save_user_configs()
-    await update.message.reply_text("✅ 已清除所有余额历史记录")
+async def add_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /add_token 命令 - 为所有地址或指定地址额外监控一个ERC20代币"""
+    user_id = str(update.effective_user.id)
+    if not context.args:
+        await reply(update, "❌ 请提供代币合约地址：\n/add_token <token> [address]\n不指定地址时对所有监控地址生效")
+        return
+    
+    token = context.args[0]
+    if not Web3.is_address(token):
+        await reply(update, "❌ 无效的代币合约地址")
+        return
+    token = token.lower()
+    if token == T42_ASSET:
+        await reply(update, "⚠️ 42T 默认已监控")
+        return
+    
+    scope = ""
+    if len(context.args) > 1:
+        address = context.args[1]
+        if not Web3.is_address(address):
+            await reply(update, "❌ 无效的地址格式")
+            return
+        scope = address.lower()
+        if scope not in {item.lower() for item in get_user_addresses(user_id)}:
+            await reply(update, "❌ 该地址不在你的监控列表中")
+            return
+    
+    config = USER_CONFIGS.setdefault(user_id, {"addresses": []})
+    tokens = config.setdefault("tokens", [])
+    if (token, scope) in tokens:
+        await reply(update, "⚠️ 该代币已在监控中")
+        return
+    if token not in {t for t, _ in tokens} and len({t for t, _ in tokens}) >= TOKEN_WATCH_LIMIT:
+        await reply(update, f"❌ 最多额外监控 {TOKEN_WATCH_LIMIT} 个代币")
+        return
+    
+    # 每个合约的元数据只读取一次，读不到decimals说明不是ERC20合约
+    await ensure_token_metadata([token])
+    if token not in TOKEN_METADATA:
+        await reply(update, "❌ 无法读取代币信息，请确认这是ERC20合约地址")
+        return
+    
+    tokens.append((token, scope))
+    save_user_token(user_id, token, scope)
+    rebuild_token_index()
+    
+    info = TOKEN_METADATA[token]
+    target = f"<code>{Web3.to_checksum_address(scope)}</code>" if scope else "所有监控地址"
+    await reply(
+        update,
+        f"✅ 已添加代币 <b>{html.escape(info['symbol'])}</b>（{info['decimals']} 位小数）\n监控范围：{target}",
+        parse_mode='HTML'
+    )
 
-def get_balance_change(address, current_mon, current_42t):
-    """获取余额变化"""
-    if address not in BALANCE_HISTORY:
-        BALANCE_HISTORY[address] = {
-            "mon": current_mon,
-            "42t": current_42t,
-            "last_update": datetime.now().isoformat()
-        }
-        return None, None
+async def remove_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /remove_token 命令 - 取消监控代币，不指定地址时删除该代币的所有监控"""
+    user_id = str(update.effective_user.id)
+    if not context.args:
+        await reply(update, "❌ 请提供代币合约地址：\n/remove_token <token> [address]")
+        return
+    
+    token = context.args[0].lower()
+    scope = context.args[1].lower() if len(context.args) > 1 else None
+    config = USER_CONFIGS.get(user_id, {})
+    targets = [
+        (t, s) for t, s in config.get("tokens", [])
+        if t == token and (scope is None or s == scope)
+    ]
+    if not targets:
+        await reply(update, "⚠️ 没有找到该代币的监控")
+        return
+    
+    config["tokens"] = [entry for entry in config["tokens"] if entry not in targets]
+    delete_user_tokens(user_id, targets)
+    rebuild_token_index()
+    await reply(update, f"✅ 已取消监控代币 {html.escape(token_symbol(token))}")
+
+async def watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /watch 命令 - 开启余额变化推送"""
+    user_id = str(update.effective_user.id)
+    
+    if context.args and context.args[0].lower() == "off":
+        await unwatch(update, context)
+        return
+    
+    if not get_user_addresses(user_id):
+        await reply(update, "❌ 没有配置监控地址，请使用 /add_address 添加地址")
+        return
+    
+    config = USER_CONFIGS.setdefault(user_id, {"addresses": []})
+    config["watch"] = True
+    config["chat_id"] = update.effective_chat.id
+    save_user(user_id)
+    
+    await reply(
+        update,
+        f"🔔 已开启余额变化推送，每 {WATCH_INTERVAL:g} 秒检查一次，地址余额变化时会通知你\n"
+        "使用 /unwatch 关闭推送"
+    )
+
+async def unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /unwatch 命令 - 关闭余额变化推送"""
+    user_id = str(update.effective_user.id)
+    
+    if not USER_CONFIGS.get(user_id, {}).get("watch"):
+        await reply(update, "⚠️ 你还没有开启余额变化推送")
+        return
+    
+    USER_CONFIGS[user_id]["watch"] = False
+    save_user(user_id)
+    await reply(update, "🔕 已关闭余额变化推送")
+
+def format_wei_delta(delta_wei, decimals=18):
+    """格式化带符号的wei变化量"""
+    return f"{Decimal(delta_wei) / Decimal(10 ** decimals):+.6f}"
+
+def format_watch_alert(address, rows):
+    """格式化单个地址的余额变化提醒，rows 为 [(资产, 旧余额wei, 新余额wei)]"""
+    msg = f"<b>Address:</b> <code>{address}</code>\n"
+    for asset, old_wei, new_wei in rows:
+        name = "MON" if asset == NATIVE_ASSET else html.escape(token_symbol(asset))
+        decimals = 18 if asset == NATIVE_ASSET else token_decimals(asset)
+        msg += f"<b>{name}:</b> {wei_to_decimal(new_wei, decimals)} {name}"
+        if old_wei != new_wei:
+            change_symbol = "📈" if new_wei > old_wei else "📉"
+            msg += f" {change_symbol} ({format_wei_delta(new_wei - old_wei, decimals)})"
+        msg += "\n"
+    return msg
+
+async def watch_balances(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：检查所有开启推送用户的地址和代币，只通知余额有变化的用户；多进程时每个进程只检查分给自己的地址"""
+    sync_shared_state()
+    watchers = {
+        user_id: config for user_id, config in USER_CONFIGS.items()
+        if config.get("watch") and config.get("chat_id")
+    }
+    if not watchers:
+        return
+    
+    # 每个地址每轮只查询一次，与关注它的用户数量无关
+    subscribers = {}
+    for user_id in watchers:
+        for address in get_user_addresses(user_id):
+            if owns_address(address.lower()):
+                subscribers.setdefault(address.lower(), {}).setdefault(user_id, address)
+    if not subscribers:
+        return
+    
+    # 所有地址×资产放进同一个批量计划
+    addresses = list(subscribers)
+    holdings, block_number = await get_holdings_cached(addresses)
+    
+    current = {}
+    for address in addresses:
+        mon_wei, t42_wei, tokens = holdings[address]
+        current[(address, NATIVE_ASSET)] = mon_wei
+        current[(address, T42_ASSET)] = t42_wei
+        for token, balance in tokens.items():
+            current[(address, token)] = balance
+    
+    changed = {}  # (地址, 资产) -> 变化前的余额
+    for key, balance in current.items():
+        if balance is None:
+            continue
+        previous = WATCH_SNAPSHOTS.get(key)
+        WATCH_SNAPSHOTS[key] = balance
+        if previous is not None and previous != balance:
+            changed[key] = previous
+    
+    for key in list(WATCH_SNAPSHOTS):
+        if key not in current:
+            del WATCH_SNAPSHOTS[key]
+    
+    if not changed:
+        return
+    
+    alerts = {}
+    for address in dict.fromkeys(address for address, _ in changed):
+        for user_id, display_address in subscribers[address].items():
+            assets = [NATIVE_ASSET, T42_ASSET] + get_user_tokens(user_id, address)
+            if not any((address, asset) in changed for asset in assets):
+                continue
+            rows = [
+                (asset, changed.get((address, asset), WATCH_SNAPSHOTS[(address, asset)]), WATCH_SNAPSHOTS[(address, asset)])
+                for asset in assets if (address, asset) in WATCH_SNAPSHOTS
+            ]
+            alerts.setdefault(user_id, []).append(format_watch_alert(display_address, rows))
+    
+    header = f"🔔 <b>余额变化提醒</b>\n<b>Block:</b> {block_number}\n\n"
+    
+    # 所有提醒直接入队，由发送队列按限速投递，本轮检查不等待发送完成；同一聊天还没发出的提醒会合并为一条消息
+    for user_id, parts in alerts.items():
+        future = OUTBOX.post(
+            watchers[user_id]["chat_id"],
+            header + "\n".join(parts),
+            merge=True,
+            parse_mode='HTML',
+            disable_web_page_preview=True
+        )
+        future.add_done_callback(functools.partial(log_alert_result, user_id))
+
+def log_alert_result(user_id, future):
+    """记录发送失败的余额提醒"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error sending watch alert to {user_id}: {future.exception()}")
+
+def parse_time_range(text):
+    """解析时间范围参数，例如 30m / 24h / 7d / 2w"""
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    unit = text[-1].lower()
+    if unit not in units or not text[:-1].isdigit() or int(text[:-1]) <= 0:
+        return None
+    return int(text[:-1]) * units[unit]
+
+def format_wei(value, decimals=18):
+    """格式化整数wei为6位小数"""
+    return f"{Decimal(value) / Decimal(10 ** decimals):.6f}"
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /history 命令 - 查询地址的余额历史"""
+    if not context.args:
+        await reply(update, "❌ 请提供地址：\n/history <address> [范围，如 24h / 7d / 30d]")
+        return
+    
+    address = context.args[0]
+    if not Web3.is_address(address):
+        await reply(update, "❌ 无效的地址格式")
+        return
+    
+    label = context.args[1] if len(context.args) > 1 else "24h"
+    span = parse_time_range(label)
+    if span is None:
+        await reply(update, "❌ 无效的时间范围，示例：30m、24h、7d、4w")
+        return
+    
+    end = int(time.time())
+    points = query_balance_series(address, end - span, end)
+    if not points:
+        await reply(update, "📭 该时间范围内没有余额记录")
+        return
+    
+    time_format = "%m-%d %H:%M" if span <= 7 * 86400 else "%Y-%m-%d"
+    lines = [f"{'Time':<11} {'MON':>16} {'42T':>16}"]
+    for ts, _, mon_wei, t42_wei in points:
+        lines.append(f"{datetime.fromtimestamp(ts).strftime(time_format):<11} {format_wei(mon_wei):>16} {format_wei(t42_wei, token_decimals(T42_ASSET)):>16}")
+    
+    first, last = points[0], points[-1]
+    msg = (
+        f"📈 <b>余额历史</b> (最近 {label})\n"
+        f"<b>Address:</b> <code>{address}</code>\n\n"
+        f"<pre>{chr(10).join(lines)}</pre>\n"
+        f"<b>MON变化:</b> {format_wei_delta(last[2] - first[2])}\n"
+        f"<b>42T变化:</b> {format_wei_delta(last[3] - first[3], token_decimals(T42_ASSET))}"
+    )
+    await reply(update, msg, parse_mode='HTML')
+
+async def earnings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /earnings 命令 - 统计所有地址在时间范围内的42T收益"""
+    user_id = str(update.effective_user.id)
+    addresses = get_user_addresses(user_id)
+    if not addresses:
+        await reply(update, "❌ 没有配置监控地址，请使用 /add_address 添加地址")
+        return
+    
+    label = context.args[0] if context.args else "24h"
+    span = parse_time_range(label)
+    if span is None:
+        await reply(update, "❌ 无效的时间范围，示例：30m、24h、7d、4w")
+        return
+    
+    end = int(time.time())
+    total_42t = 0
+    total_mon = 0
+    lines = []
+    for address in addresses:
+        change = get_balance_range_change(address, end - span, end)
+        if change is None:
+            lines.append(f"<code>{address[:10]}...</code> 暂无记录")
+            continue
+        start_point, end_point = change
+        delta_42t = end_point[3] - start_point[3]
+        delta_mon = end_point[2] - start_point[2]
+        total_42t += delta_42t
+        total_mon += delta_mon
+        lines.append(f"<code>{address[:10]}...</code> {format_wei_delta(delta_42t, token_decimals(T42_ASSET))} 42T")
+    
+    msg = (
+        f"💰 <b>收益统计</b> (最近 {label})\n\n"
+        + "\n".join(lines)
+        + f"\n\n<b>42T合计:</b> {format_wei_delta(total_42t, token_decimals(T42_ASSET))} 42T"
+        + f"\n<b>MON合计:</b> {format_wei_delta(total_mon)} MON"
+    )
+    await reply(update, msg, parse_mode='HTML')
+
+def format_mover(address, delta):
+    """格式化涨跌榜中的一行"""
+    return f"<code>{address[:10]}...</code> {format_wei_delta(delta, token_decimals(T42_ASSET))} 42T"
+
+async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /summary 命令 - 汇总所有地址的余额合计、时间范围内的变化和42T涨跌最多的地址"""
+    user_id = str(update.effective_user.id)
+    addresses = get_user_addresses(user_id)
+    if not addresses:
+        await reply(update, "❌ 没有配置监控地址，请使用 /add_address 添加地址")
+        return
+    
+    label = context.args[0] if context.args else "24h"
+    span = parse_time_range(label)
+    if span is None:
+        await reply(update, "❌ 无效的时间范围，示例：30m、24h、7d、4w")
+        return
+    
+    # 当前余额一次批量读取，起点余额每批地址一次分组查询
+    balances, block_number = await get_balances_cached(addresses)
+    end = int(time.time())
+    start = end - span
+    flush_balance_series()
+    baselines = get_samples_at(addresses, choose_history_tier(start, end), start)
     
-    prev = BALANCE_HISTORY[address]
-    mon_change = None
-    t42_change = None
+    # 按列整体计算，全程使用整数wei
+    mon_now = [balances[address][0] for address in addresses]
+    t42_now = [balances[address][1] for address in addresses]
+    base = [baselines.get(address.lower()) for address in addresses]
+    mon_delta = [
+        now - b[0] if now is not None and b is not None else None
+        for now, b in zip(mon_now, base)
+    ]
+    t42_delta = [
+        now - b[1] if now is not None and b is not None else None
+        for now, b in zip(t42_now, base)
+    ]
     
-    if isinstance(current_mon, (int, float)) and isinstance(prev["mon"], (int, float)):
-        mon_change = current_mon - prev["mon"]
+    known = [i for i, delta in enumerate(t42_delta) if delta is not None]
+    gainers = heapq.nlargest(SUMMARY_TOP_MOVERS, (i for i in known if t42_delta[i] > 0), key=t42_delta.__getitem__)
+    losers = heapq.nsmallest(SUMMARY_TOP_MOVERS, (i for i in known if t42_delta[i] < 0), key=t42_delta.__getitem__)
+    up = sum(1 for i in known if t42_delta[i] > 0)
+    down = sum(1 for i in known if t42_delta[i] < 0)
+    failed = sum(1 for mon, t42 in zip(mon_now, t42_now) if mon is None or t42 is None)
     
-    if isinstance(current_42t, (int, float)) and isinstance(prev["42t"], (int, float)):
-        t42_change = current_42t - prev["42t"]
+    msg = (
+        f"📊 <b>资产汇总</b> (最近 {label})\n"
+        f"<b>地址数:</b> {len(addresses)}"
+        + (f" | <b>Block:</b> {block_number}" if block_number is not None else "")
+        + f"\n\n<b>MON合计:</b> {format_wei(sum(v for v in mon_now if v is not None))} MON"
+        + f"\n<b>42T合计:</b> {format_wei(sum(v for v in t42_now if v is not None), token_decimals(T42_ASSET))} 42T"
+        + f"\n<b>MON变化:</b> {format_wei_delta(sum(v for v in mon_delta if v is not None))} MON"
+        + f"\n<b>42T变化:</b> {format_wei_delta(sum(v for v in t42_delta if v is not None), token_decimals(T42_ASSET))} 42T"
+        + f"\n\n📈 上涨 {up} | 📉 下跌 {down} | ➖ 无变化 {len(known) - up - down}"
+        + f" | 暂无记录 {len(addresses) - len(known)}"
+    )
+    if failed:
+        msg += f"\n⚠️ {failed} 个地址余额读取失败，未计入合计"
+    if gainers:
+        msg += "\n\n<b>42T涨幅最大：</b>\n" + "\n".join(format_mover(addresses[i], t42_delta[i]) for i in gainers)
+    if losers:
+        msg += "\n\n<b>42T跌幅最大：</b>\n" + "\n".join(format_mover(addresses[i], t42_delta[i]) for i in losers)
+    await reply(update, msg, parse_mode='HTML')
+
+async def rpc_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /rpc_status 命令"""
+    msg = f"🛰 <b>RPC节点状态</b> (对冲请求: {RPC_ROUTER.hedged})\n\n"
+    for stats in RPC_ROUTER.stats():
+        latency = f"{stats['latency_ms']}ms" if stats["latency_ms"] is not None else "-"
+        state = f"⏸ 退避 {stats['backoff']}s" if stats["backoff"] else "✅"
+        msg += (
+            f"{state} <code>{stats['url']}</code>\n"
+            f"延迟: {latency} | 错误率: {stats['error_rate']:.1%} | 速率: {stats['rate']}/s\n"
+            f"请求: {stats['requests']} | 错误: {stats['errors']} | 限流: {stats['rate_limited']}\n\n"
+        )
+    await reply(update, msg, parse_mode='HTML', disable_web_page_preview=True)
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /cache_stats 命令"""
+    msg = "📊 <b>缓存统计：</b>\n\n"
+    for name, cache in (("余额", BALANCE_CACHE), ("交易记录", ACTIVITY_CACHE)):
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        hit_rate = (stats["hits"] + stats["coalesced"]) / lookups * 100 if lookups else 0
+        msg += (
+            f"<b>{name}</b> (TTL {cache.ttl:g}s)\n"
+            f"命中: {stats['hits']} | 未命中: {stats['misses']} | 合并: {stats['coalesced']}\n"
+            f"条目: {stats['size']}/{cache.maxsize} | 命中率: {hit_rate:.1f}%\n\n"
+        )
+    await reply(update, msg, parse_mode='HTML')
+
+async def queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /queue_stats 命令"""
+    stats = OUTBOX.stats()
+    p50 = f"{stats['p50_ms']}ms" if stats["p50_ms"] is not None else "-"
+    p99 = f"{stats['p99_ms']}ms" if stats["p99_ms"] is not None else "-"
+    msg = (
+        "📤 <b>发送队列统计：</b>\n\n"
+        f"排队消息: {stats['depth']} | 排队聊天: {stats['chats']}\n"
+        f"已发送: {stats['sent']} | 合并: {stats['merged']} | 失败: {stats['failed']}\n"
+        f"RetryAfter: {stats['retry_after']}\n"
+        f"发送延迟: p50 {p50} | p99 {p99}\n"
+        f"限速: 全局 {OUTBOX.global_rate:g}/s，每个聊天间隔 {OUTBOX.chat_interval:g}s"
+    )
+    await reply(update, msg, parse_mode='HTML')
+
+def is_admin(update):
+    return str(update.effective_user.id) in ADMIN_USER_IDS
+
+def format_latency_rows(name, label):
+    """把某个延迟指标的每个标签组合格式化为一行：次数、p50/p95和错误数"""
+    rows = []
+    for labels, histogram in sorted(METRICS.series(name), key=lambda item: -item[1].count):
+        title = "/".join(labels[key] for key in label)
+        p50 = histogram.quantile(0.5)
+        p95 = histogram.quantile(0.95)
+        rows.append(
+            f"{title}: {histogram.count}次 | p50 ≤{format_seconds(p50)} | p95 ≤{format_seconds(p95)} | 错误 {histogram.errors}"
+        )
+    return rows or ["暂无数据"]
+
+def format_seconds(value):
+    if value == float("inf"):
+        return "∞"
+    return f"{value * 1000:g}ms" if value < 1 else f"{value:g}s"
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /stats 命令 - 管理员查看命令和上游接口的延迟、错误以及缓存和队列状态"""
+    if not is_admin(update):
+        await reply(update, "❌ 无权限")
+        return
+    msg = "📊 <b>运行统计：</b>\n\n<b>命令</b>\n"
+    msg += "\n".join(html.escape(row) for row in format_latency_rows("fortytwo_command_seconds", ("command",)))
+    msg += "\n\n<b>上游接口</b>\n"
+    msg += "\n".join(html.escape(row) for row in format_latency_rows("fortytwo_upstream_seconds", ("upstream", "target")))
+    msg += "\n\n<b>缓存</b>\n"
+    for name, cache in (("余额", BALANCE_CACHE), ("交易记录", ACTIVITY_CACHE)):
+        counters = cache.stats()
+        msg += f"{name}: 命中 {counters['hits']} | 未命中 {counters['misses']} | 合并 {counters['coalesced']} | 条目 {counters['size']}\n"
+    queue = OUTBOX.stats()
+    msg += f"\n<b>发送队列</b>\n排队 {queue['depth']} | 已发送 {queue['sent']} | 失败 {queue['failed']} | RetryAfter {queue['retry_after']}\n"
+    if METRICS_SERVER is not None:
+        msg += f"\n指标端口: http://{METRICS_HOST}:{METRICS_PORT + WORKER_INDEX}/metrics"
+    await reply(update, msg, parse_mode='HTML')
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /profile 命令 - 管理员开关采样分析器：/profile on [秒数] | off | status"""
+    if not is_admin(update):
+        await reply(update, "❌ 无权限")
+        return
+    action = context.args[0].lower() if context.args else "status"
+    if action == "on":
+        if PROFILER.running():
+            await reply(update, "⚠️ 采样分析器已在运行")
+            return
+        try:
+            duration = float(context.args[1]) if len(context.args) > 1 else PROFILE_MAX_SECONDS
+        except ValueError:
+            await reply(update, "❌ 时长格式无效，例如：/profile on 60")
+            return
+        duration = min(max(duration, 1), PROFILE_MAX_SECONDS)
+        PROFILER.start(duration)
+        await reply(update, f"✅ 采样分析器已启动，{duration:g} 秒后自动停止，使用 /profile off 查看结果")
+    elif action == "off":
+        PROFILER.stop()
+        await reply(update, f"<pre>{html.escape(PROFILER.report())}</pre>", parse_mode='HTML')
+    elif action == "status":
+        if PROFILER.running():
+            elapsed = time.monotonic() - PROFILER.started_at
+            await reply(update, f"🔍 采样分析器运行中：已运行 {elapsed:.0f} 秒，采样 {PROFILER.samples} 次")
+        else:
+            await reply(update, f"采样分析器未运行，最近一次采样 {PROFILER.samples} 次")
+    else:
+        await reply(update, "❌ 用法：/profile on [秒数] | off | status")
+
+def instrument_command(name, handler):
+    """包装命令处理函数，记录每个命令的耗时和异常次数"""
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with METRICS.timer("fortytwo_command_seconds", command=name):
+            return await handler(update, context)
+    return wrapped
+
+async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /clear_history 命令"""
+    clear_balance_history()
+    await reply(update, "✅ 已清除所有余额历史记录")
+
+def get_balance_change(address, mon_wei, t42_wei):
+    """与上次记录的余额比较，返回整数wei变化量 (MON, 42T)；没有记录或读取失败的一项为None"""
+    if SHARED_STATE:
+        # 多进程时以数据库中的记录为准，调用方在每批刷新后写回
+        row = DB.execute("SELECT mon, t42, last_update FROM balance_snapshots WHERE address = ?", (address,)).fetchone()
+        prev = {"mon": parse_stored_balance(row[0]), "42t": parse_stored_balance(row[1]), "last_update": row[2]} if row else None
+    else:
+        prev = BALANCE_HISTORY.get(address)
+    changes = (None, None)
+    if prev is not None:
+        changes = tuple(
+            current - previous if current is not None and previous is not None else None
+            for current, previous in ((mon_wei, prev["mon"]), (t42_wei, prev["42t"]))
+        )
     
-    # 更新历史记录
+    # 更新历史记录，读取失败的一项保留上次的值
     BALANCE_HISTORY[address] = {
-        "mon": current_mon,
-        "42t": current_42t,
+        "mon": mon_wei if mon_wei is not None or prev is None else prev["mon"],
+        "42t": t42_wei if t42_wei is not None or prev is None else prev["42t"],
         "last_update": datetime.now().isoformat()
     }
+    DIRTY_SNAPSHOTS.add(address)
+    
+    return changes
+
+async def sync_state_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """多进程模式下处理每个更新之前同步其他进程的配置修改"""
+    sync_shared_state()
+
+async def handle_webhook_request(application, reader, writer):
+    """接收Telegram推送的更新：校验路径和secret后放入Application的更新队列，每次响应后关闭连接"""
+    try:
+        method, path, headers = await read_http_head(reader, 10)
+        length = int(headers.get("content-length") or 0)
+        if method != "POST" or path != WEBHOOK_PATH:
+            status = "404 Not Found"
+        elif WEBHOOK_SECRET and not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), WEBHOOK_SECRET):
+            status = "403 Forbidden"
+        elif length > WEBHOOK_MAX_BODY:
+            status = "413 Payload Too Large"
+        else:
+            body = await asyncio.wait_for(reader.readexactly(length), 10)
+            try:
+                update = Update.de_json(json.loads(body), application.bot)
+            except (ValueError, TypeError, KeyError):
+                status = "400 Bad Request"
+            else:
+                await application.update_queue.put(update)
+                status = "200 OK"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def run_webhook(application):
+    """webhook模式：启动Application，在共用端口上接收Telegram推送的更新，收到SIGTERM/SIGINT后退出"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    
+    async with application:
+        await init_clients(application)
+        if WORKER_INDEX == 0:
+            await application.bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET or None,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES
+            )
+        # 多个工作进程用 SO_REUSEPORT 监听同一端口，由内核分配连接
+        server = await asyncio.start_server(
+            functools.partial(handle_webhook_request, application),
+            WEBHOOK_LISTEN,
+            WEBHOOK_PORT,
+            reuse_port=SHARED_STATE
+        )
+        await application.start()
+        print(f"Worker {WORKER_INDEX + 1}/{WORKER_COUNT} receiving updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await application.stop()
+            await shutdown(application)
+
+def run_workers():
+    """webhook多进程模式的主进程：启动 BOT_WORKERS 个工作进程，异常退出的进程延迟后自动重启"""
+    script = os.path.abspath(__file__)
+    workers = {}
+    started = {}
+    stopping = False
+    
+    def start_worker(index):
+        env = dict(os.environ, BOT_WORKER_INDEX=str(index))
+        workers[index] = subprocess.Popen([sys.executable, script], env=env)
+        started[index] = time.monotonic()
+        print(f"Started worker {index} (pid {workers[index].pid})")
+    
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
     
-    return mon_change, t42_change
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    for index in range(WORKER_COUNT):
+        start_worker(index)
+    
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(workers.items()):
+            if process.poll() is not None and not stopping and time.monotonic() - started[index] >= WORKER_RESTART_DELAY:
+                print(f"Worker {index} exited with code {process.returncode}, restarting")
+                start_worker(index)
+    
+    for process in workers.values():
+        if process.poll() is None:
+            process.terminate()
+    for index, process in workers.items():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            print(f"Worker {index} did not exit in time, killing")
+            process.kill()
+
+def build_application(token, **options):
+    """创建Application并注册命令处理函数；更新并发处理，options 为额外的构建参数（如 base_url、request）"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(init_clients)
+        .post_shutdown(shutdown)
+        .concurrent_updates(CONCURRENT_UPDATES)
+    )
+    if BOT_MODE == "webhook":
+        # webhook模式由 run_webhook 自己接收更新，不需要轮询用的Updater
+        builder.updater(None)
+    for name, value in options.items():
+        getattr(builder, name)(value)
+    application = builder.build()
+    
+    if SHARED_STATE:
+        application.add_handler(TypeHandler(Update, sync_state_handler), group=-1)
+    
+    commands = {
+        "start": start,
+        "help": help_command,
+        "check": check_all,
+        "check_address": check_address,
+        "add_address": add_address,
+        "add_addresses": add_addresses,
+        "remove_addresses": remove_addresses,
+        "list_addresses": list_addresses,
+        "add_token": add_token,
+        "remove_token": remove_token,
+        "history": history,
+        "earnings": earnings,
+        "summary": summary,
+        "watch": watch,
+        "unwatch": unwatch,
+        "clear_history": clear_history,
+        "cache_stats": cache_stats,
+        "queue_stats": queue_stats,
+        "rpc_status": rpc_status,
+        "stats": stats,
+        "profile": profile
+    }
+    for name, handler in commands.items():
+        application.add_handler(CommandHandler(name, instrument_command(name, handler)))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/add_addresses"),
+        instrument_command("add_addresses_document", add_addresses_document)
+    ))
+    return application
 
 def main():
     """主函数"""
+    init_storage()
     load_user_configs()
+    load_tx_index()
     
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
@@ -465,20 +3519,45 @@ def main():
         print("例如：export TELEGRAM_BOT_TOKEN='your_bot_token_here'")
         return
     
-    application = Application.builder().token(token).build()
+    if BOT_MODE not in ("polling", "webhook"):
+        print(f"❌ 未知的运行模式 BOT_MODE={BOT_MODE}，可选 polling 或 webhook")
+        return
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        print("❌ webhook模式需要设置环境变量 WEBHOOK_URL")
+        return
+    if BOT_MODE == "polling" and BOT_WORKERS > 1:
+        print("⚠️ polling模式只能运行一个进程，BOT_WORKERS 仅在 webhook 模式下生效")
+    
+    if SHARED_STATE and "BOT_WORKER_INDEX" not in os.environ:
+        # 主进程只负责数据库迁移和管理工作进程
+        close_storage()
+        run_workers()
+        return
     
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("check", check_all))
-    application.add_handler(CommandHandler("check_address", check_address))
-    application.add_handler(CommandHandler("add_address", add_address))
-    application.add_handler(CommandHandler("list_addresses", list_addresses))
-    application.add_handler(CommandHandler("clear_history", clear_history))
+    # 上次运行或其他工作进程保存的快照仍在有效期内时可以直接用于 /check
+    sync_report_snapshots(since=time.time() - SNAPSHOT_MAX_AGE)
+    
+    application = build_application(token)
+    
+    if application.job_queue is None:
+        print("⚠️ 未安装 python-telegram-bot[job-queue]，后台任务未启动")
+    else:
+        application.job_queue.run_repeating(watch_balances, interval=WATCH_INTERVAL, first=WATCH_INTERVAL)
+        application.job_queue.run_repeating(refresh_snapshots_job, interval=SNAPSHOT_TICK_INTERVAL, first=1)
+        application.job_queue.run_repeating(flush_balance_history_job, interval=BALANCE_FLUSH_INTERVAL, first=BALANCE_FLUSH_INTERVAL)
+        if WORKER_INDEX == 0:
+            # 清理和区块索引是全局任务，只在0号工作进程运行
+            application.job_queue.run_repeating(prune_balance_series_job, interval=3600, first=60)
+            if INDEXER_ENABLED:
+                application.job_queue.run_repeating(run_block_indexer, interval=INDEXER_INTERVAL, first=1)
     
     print("🤖 FortyTwo Token Monitor Bot 正在启动...")
     print("使用 /start 开始使用机器人")
     
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -5,7 +5,7 @@ from pathlib import Path
 
 VENV_DIR = Path(".venv")
 MAIN_SCRIPT = "fortytwo_telegram_bot.py"
-REQUIREMENTS = ["web3", "requests", "python-telegram-bot"]
+REQUIREMENTS = ["web3", "requests", "httpx", "python-telegram-bot[job-queue]"]
 
 def create_venv():
     print("Creating virtual environment...")
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""测试公共夹具：每个测试使用临时目录中的独立数据库"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fortytwo_telegram_bot as bot_module
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """在临时目录中初始化数据库，测试结束后关闭并清空内存状态"""
+    monkeypatch.chdir(tmp_path)
+    bot_module.SERIES_LAST.clear()
+    bot_module.SERIES_PENDING.clear()
+    bot_module.SNAPSHOTS.clear()
+    bot_module.BALANCE_HISTORY.clear()
+    bot_module.init_storage(str(tmp_path / "fortytwo_bot.db"))
+    yield bot_module
+    bot_module.close_storage()
+    bot_module.SERIES_LAST.clear()
+    bot_module.SERIES_PENDING.clear()
+    bot_module.SNAPSHOTS.clear()
+    bot_module.BALANCE_HISTORY.clear()
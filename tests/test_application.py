@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Application 构建：更新并发处理"""
+
+import fortytwo_telegram_bot as bot
+
+TOKEN = "123456:TEST"
+
+
+def application_commands(application):
+    return {command for handler in application.handlers[0] for command in getattr(handler, "commands", ())}
+
+
+def test_updates_are_processed_concurrently():
+    """一个用户的命令在等待上游时，其他用户的更新仍会被处理"""
+    application = bot.build_application(TOKEN)
+    assert application.concurrent_updates == bot.CONCURRENT_UPDATES > 1
+
+
+def test_command_handlers_registered():
+    handlers = application_commands(bot.build_application(TOKEN))
+    assert {"check", "check_address", "summary", "watch"} <= handlers
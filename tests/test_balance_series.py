@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""余额时间序列：汇总层级的时间桶和过期清理"""
+
+import time
+
+ADDRESS = "0x" + "ab" * 20
+DAY = 86400
+
+
+def test_prune_keeps_opening_balance(bot):
+    """清理后窗口起点之前的最后一条记录仍然保留，范围变化不受影响"""
+    now = int(time.time())
+    cutoff = now - bot.HISTORY_TIERS[0][1]
+    start = cutoff + 60
+    bot.record_balance_sample(ADDRESS, 1, cutoff - 3600, 0, 10)
+    bot.record_balance_sample(ADDRESS, 2, cutoff - 60, 0, 100)
+    bot.record_balance_sample(ADDRESS, 3, cutoff + 600, 0, 150)
+    assert bot.choose_history_tier(start, now) == 0
+    
+    opening, closing = bot.get_balance_range_change(ADDRESS, start, now)
+    assert closing[3] - opening[3] == 50
+    
+    bot.prune_balance_series(now)
+    
+    opening, closing = bot.get_balance_range_change(ADDRESS, start, now)
+    assert closing[3] - opening[3] == 50
+    rows = bot.DB.execute(
+        "SELECT ts FROM balance_series WHERE address = ? AND tier = 0 ORDER BY ts", (ADDRESS,)
+    ).fetchall()
+    assert [ts for (ts,) in rows] == [cutoff - 60, cutoff + 600]
+
+
+def test_prune_removes_expired_rows(bot):
+    """截止时间之前只保留每个地址的最后一条记录"""
+    now = 100 * DAY
+    cutoff = now - bot.HISTORY_TIERS[0][1]
+    for i in range(5):
+        bot.record_balance_sample(ADDRESS, i, cutoff - 1000 + i * 100, 0, i + 1)
+    bot.prune_balance_series(now)
+    rows = bot.DB.execute("SELECT ts FROM balance_series WHERE tier = 0").fetchall()
+    assert rows == [(cutoff - 600,)]
+
+
+def test_rollup_bucket_keeps_last_value(bot):
+    """同一时间桶内的多次采样，汇总层级保留最后一次的余额"""
+    bucket = 1000 * 3600
+    bot.record_balance_sample(ADDRESS, 1, bucket + 10, 0, 1)
+    bot.record_balance_sample(ADDRESS, 2, bucket + 20, 0, 2)
+    bot.flush_balance_series()
+    # 已写入数据库的记录同样会被替换
+    bot.record_balance_sample(ADDRESS, 3, bucket + 30, 0, 3)
+    bot.flush_balance_series()
+    
+    for tier in (1, 2, 3):
+        rows = bot.DB.execute(
+            "SELECT ts, block FROM balance_series WHERE address = ? AND tier = ?", (ADDRESS, tier)
+        ).fetchall()
+        assert rows == [(bucket + 30, 3)]
+    raw = bot.DB.execute("SELECT COUNT(*) FROM balance_series WHERE tier = 0").fetchone()[0]
+    assert raw == 3
+
+
+def test_rollup_new_bucket_appends(bot):
+    """进入新的时间桶时追加记录"""
+    bucket = 1000 * 3600
+    bot.record_balance_sample(ADDRESS, 1, bucket + 10, 0, 1)
+    bot.record_balance_sample(ADDRESS, 2, bucket + 3600 + 10, 0, 2)
+    bot.flush_balance_series()
+    rows = bot.DB.execute(
+        "SELECT ts, block FROM balance_series WHERE address = ? AND tier = 2 ORDER BY ts", (ADDRESS,)
+    ).fetchall()
+    assert rows == [(bucket + 10, 1), (bucket + 3610, 2)]
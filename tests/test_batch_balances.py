@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""JSON-RPC批量余额读取：分批发送并固定在同一区块"""
+
+import asyncio
+
+import fortytwo_telegram_bot as bot
+
+
+def test_rpc_batch_balances_are_chunked(monkeypatch):
+    batches = []
+    
+    async def rpc_call(method, params):
+        assert method == "eth_blockNumber"
+        return hex(100)
+    
+    async def rpc_batch(calls):
+        batches.append(calls)
+        if len(batches) == 2:
+            raise RuntimeError("batch too large")
+        return [hex(7)] * len(calls)
+    
+    monkeypatch.setattr(bot, "RPC_BATCH_SIZE", 4)
+    monkeypatch.setattr(bot, "rpc_call", rpc_call)
+    monkeypatch.setattr(bot, "rpc_batch", rpc_batch)
+    pairs = [("0x" + f"{i:040x}", bot.NATIVE_ASSET) for i in range(10)]
+    
+    balances, block_number = asyncio.run(bot.rpc_batch_balances(pairs))
+    
+    assert block_number == 100
+    assert [len(calls) for calls in batches] == [4, 4, 2]
+    assert all(params[1] == hex(100) for calls in batches for _, params in calls)
+    assert [balances[pair] for pair in pairs] == [7] * 4 + [None] * 4 + [7] * 2
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""eth_getLogs：节点拒绝范围过大时二分重试，限流和超时直接抛出"""
+
+import asyncio
+
+import pytest
+
+import fortytwo_telegram_bot as bot
+
+
+@pytest.fixture
+def logs_state(monkeypatch):
+    monkeypatch.setitem(bot.LOGS_STATE, "chunk_size", 1000)
+
+
+def stub_rpc(monkeypatch, error_for):
+    """替换 rpc_call：error_for(区块数) 返回要抛出的异常，None 表示返回空结果"""
+    calls = []
+    
+    async def rpc_call(method, params):
+        start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+        calls.append((start, end))
+        error = error_for(end - start + 1)
+        if error is not None:
+            raise error
+        return []
+    
+    monkeypatch.setattr(bot, "rpc_call", rpc_call)
+    return calls
+
+
+@pytest.mark.parametrize("error", [
+    bot.RpcRateLimited("http://node rate limited"),
+    TimeoutError("RPC call exceeded 20s deadline"),
+    RuntimeError("execution reverted: limit exceeded")
+])
+def test_non_range_errors_are_not_bisected(monkeypatch, logs_state, error):
+    calls = stub_rpc(monkeypatch, lambda size: error)
+    with pytest.raises(type(error)):
+        asyncio.run(bot.get_logs_range([], 0, 999))
+    assert len(calls) == 1
+    assert bot.LOGS_STATE["chunk_size"] == 1000
+
+
+def test_range_rejection_is_bisected(monkeypatch, logs_state):
+    calls = stub_rpc(monkeypatch, lambda size: RuntimeError("block range is too wide") if size > 500 else None)
+    assert asyncio.run(bot.get_logs_range([], 0, 999)) == []
+    assert sorted(calls) == [(0, 499), (0, 999), (500, 999)]
+    assert bot.LOGS_STATE["chunk_size"] == 500
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""最近交易：数据源全部失败时的结果不缓存"""
+
+import asyncio
+
+import pytest
+
+import fortytwo_telegram_bot as bot
+
+ADDRESS = "0x" + "aa" * 20
+
+
+class StubProvider(bot.ActivityProvider):
+    name = "stub"
+    
+    def __init__(self, result):
+        super().__init__(timeout=1)
+        self.result = result
+    
+    async def fetch(self, address, limit):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    monkeypatch.setattr(bot, "ACTIVITY_CACHE", bot.TTLCache(ttl=60, maxsize=10))
+    monkeypatch.setattr(bot, "TX_INDEX", {"addresses": {}})
+    stub = StubProvider(RuntimeError("provider down"))
+    monkeypatch.setattr(bot, "ACTIVITY_PROVIDERS", [stub])
+    return stub
+
+
+def test_total_failure_is_not_cached(providers):
+    """所有数据源都失败时返回None且不缓存，数据源恢复后立即拿到新结果"""
+    assert asyncio.run(bot.get_recent_transactions_cached(ADDRESS)) is None
+    
+    tx = {"time": "2025-01-01 00:00:00", "hash": "0x" + "11" * 32}
+    providers.result = [tx]
+    assert asyncio.run(bot.get_recent_transactions_cached(ADDRESS)) == [tx]
+
+
+def test_empty_answer_is_cached(providers):
+    """数据源确认没有交易时缓存空列表"""
+    providers.result = []
+    assert asyncio.run(bot.get_recent_transactions_cached(ADDRESS)) == []
+    assert bot.ACTIVITY_CACHE.get((ADDRESS, 3)) == []
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""报告快照：读取失败的处理、按用户显示的额外代币和数据库持久化"""
+
+import json
+import time
+
+import pytest
+
+ADDRESS = "0x" + "cd" * 20
+TOKEN = "0x" + "ef" * 20
+
+
+@pytest.fixture
+def shared_address(bot, monkeypatch):
+    """两个用户监控同一地址，只有 alice 额外监控了代币"""
+    monkeypatch.setattr(bot, "USER_CONFIGS", {
+        "alice": {"addresses": [ADDRESS], "tokens": [(TOKEN, "")]},
+        "bob": {"addresses": [ADDRESS]}
+    })
+    monkeypatch.setitem(bot.TOKEN_METADATA, TOKEN, {"symbol": "SECRET", "decimals": 18})
+    bot.rebuild_token_index()
+    yield bot
+    bot.ADDRESS_TOKENS.clear()
+
+
+def test_failed_first_read_is_not_cached(bot):
+    """首次读取失败时返回错误快照用于显示，但不缓存，下次查看时重新查询"""
+    now = time.time()
+    snapshot = bot.update_snapshot(ADDRESS, (None, None, {}), [], None, now)
+    
+    assert "Error" in snapshot["html"]
+    assert ADDRESS not in bot.SNAPSHOTS
+    assert bot.is_snapshot_stale(ADDRESS, now)
+
+
+def test_failed_read_keeps_previous_snapshot(bot):
+    """已有快照时读取失败保留旧快照"""
+    now = time.time()
+    first = bot.update_snapshot(ADDRESS, (10, 20, {}), [], 1, now)
+    again = bot.update_snapshot(ADDRESS, (None, None, {}), [], 2, now + 1)
+    
+    assert again is first
+    assert again["mon_wei"] == 10
+    assert not bot.is_snapshot_stale(ADDRESS, now + 1)
+
+
+def test_token_rows_are_rendered_per_user(shared_address):
+    """快照读取的是所有用户代币的并集，但每个用户只看到自己监控的代币"""
+    bot = shared_address
+    assert bot.ADDRESS_TOKENS[ADDRESS] == {TOKEN}
+    snapshot = bot.update_snapshot(ADDRESS, (10, 20, {TOKEN: 5 * 10 ** 18}), [], 1, time.time())
+    
+    alice = bot.format_snapshot(snapshot, bot.get_report_tokens("alice", ADDRESS))
+    bob = bot.format_snapshot(snapshot, bot.get_report_tokens("bob", ADDRESS))
+    
+    assert "SECRET" in alice
+    assert "SECRET" not in bob
+    assert "SECRET" not in snapshot["html"]
+
+
+def test_staleness_follows_viewer_tokens(shared_address):
+    """只有查看用户自己的代币不在快照中时才需要实时查询"""
+    bot = shared_address
+    now = time.time()
+    bot.update_snapshot(ADDRESS, (10, 20, {}), [], 1, now)
+    
+    assert not bot.is_snapshot_stale(ADDRESS, now, bot.get_report_tokens("bob", ADDRESS))
+    assert bot.is_snapshot_stale(ADDRESS, now, bot.get_report_tokens("alice", ADDRESS))
+
+
+def test_other_addresses_show_no_tokens(shared_address):
+    """查询不在自己监控列表中的地址时不显示额外代币"""
+    assert shared_address.get_report_tokens("alice", "0x" + "12" * 20) == []
+
+
+def test_error_snapshots_are_not_persisted(bot):
+    """读取失败的快照不写入数据库"""
+    snapshot = bot.update_snapshot(ADDRESS, (None, None, {}), [], None, time.time())
+    bot.save_report_snapshots([snapshot])
+    
+    assert bot.DB.execute("SELECT COUNT(*) FROM report_snapshots").fetchone()[0] == 0
+
+
+def test_persisted_snapshot_has_no_token_rows(shared_address):
+    """数据库中的快照HTML不包含任何用户的额外代币"""
+    bot = shared_address
+    snapshot = bot.update_snapshot(ADDRESS, (10, 20, {TOKEN: 5 * 10 ** 18}), [], 1, time.time())
+    bot.save_report_snapshots([snapshot])
+    
+    (data,) = bot.DB.execute("SELECT data FROM report_snapshots WHERE address = ?", (ADDRESS,)).fetchone()
+    assert "SECRET" not in json.loads(data)["html"]
+
+
+def test_view_before_first_snapshot_is_recorded(bot, monkeypatch):
+    """地址还没有快照时也记录查看时间，同步时不会把占位记录当作快照"""
+    monkeypatch.setattr(bot, "SNAPSHOT_VIEWS", {})
+    now = time.time()
+    bot.mark_snapshots_viewed([ADDRESS], now)
+    bot.sync_report_snapshots(since=0)
+    
+    assert bot.SNAPSHOT_VIEWS[ADDRESS] == now
+    assert ADDRESS not in bot.SNAPSHOTS
+    
+    snapshot = bot.update_snapshot(ADDRESS, (10, 20, {}), [], 1, now + 1)
+    bot.save_report_snapshots([snapshot])
+    row = bot.DB.execute("SELECT updated, viewed FROM report_snapshots WHERE address = ?", (ADDRESS,)).fetchone()
+    assert row == (now + 1, now)
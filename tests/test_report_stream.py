@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""流式报告：中间进度限速，最终结果交给发送队列"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import fortytwo_telegram_bot as bot
+
+
+def test_final_flush_does_not_sleep(monkeypatch):
+    """状态消息刚发出时，最终结果立即入队，不在处理函数里等待编辑间隔"""
+    edits = []
+    
+    async def edit(message, text, **kwargs):
+        edits.append(text)
+    
+    monkeypatch.setattr(bot, "REPORT_EDIT_INTERVAL", 5.0)
+    monkeypatch.setattr(bot.OUTBOX, "edit", edit)
+    
+    async def scenario():
+        stream = bot.ReportStream(None, SimpleNamespace(chat_id=1, message_id=1))
+        await stream.add("first")
+        await stream.flush()
+        assert edits == []  # 中间进度不足间隔，直接跳过
+        started = time.monotonic()
+        await stream.flush(force=True)
+        return time.monotonic() - started
+    
+    assert asyncio.run(scenario()) < 1.0
+    assert edits == ["first"]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""RPC路由：退避中的节点和对冲请求的计时"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+PAYLOAD = {"jsonrpc": "2.0", "id": 1, "method": "eth_blockNumber", "params": []}
+
+
+class FakeClient:
+    """按URL返回预设延迟的响应，并记录每次请求的发送时间"""
+    
+    def __init__(self, delays):
+        self.delays = delays
+        self.calls = []
+    
+    async def post(self, url, json):
+        self.calls.append((url, time.monotonic()))
+        await asyncio.sleep(self.delays.get(url, 0))
+        return httpx.Response(200, json={"jsonrpc": "2.0", "id": 1, "result": url}, request=httpx.Request("POST", url))
+
+
+@pytest.fixture
+def client(bot, monkeypatch):
+    fake = FakeClient({})
+    monkeypatch.setattr(bot, "HTTP_CLIENT", fake)
+    return fake
+
+
+def test_waits_for_backoff_within_deadline(bot, client, monkeypatch):
+    """唯一的节点在退避中时，等到 backoff_until 再发送"""
+    monkeypatch.setattr(bot, "RPC_CALL_DEADLINE", 5.0)
+    router = bot.RpcRouter(["http://a"])
+    router.endpoints[0].backoff_until = time.monotonic() + 0.2
+    backoff_until = router.endpoints[0].backoff_until
+    
+    result = asyncio.run(router.request(PAYLOAD))
+    
+    assert result["result"] == "http://a"
+    assert client.calls[0][1] >= backoff_until
+
+
+def test_fails_fast_when_backoff_exceeds_deadline(bot, client, monkeypatch):
+    """退避时间超过调用时限时立即失败，不向节点发送请求"""
+    monkeypatch.setattr(bot, "RPC_CALL_DEADLINE", 1.0)
+    router = bot.RpcRouter(["http://a"])
+    router.endpoints[0].backoff_until = time.monotonic() + 30
+    
+    started = time.monotonic()
+    with pytest.raises(bot.RpcRateLimited):
+        asyncio.run(router.request(PAYLOAD))
+    
+    assert time.monotonic() - started < 0.5
+    assert client.calls == []
+
+
+def test_hedge_delay_counts_from_send(bot, client, monkeypatch):
+    """对冲请求在首个请求发出后经过对冲延迟才发送，令牌桶等待不计入"""
+    monkeypatch.setattr(bot, "RPC_CALL_DEADLINE", 5.0)
+    client.delays = {"http://slow": 1.0}
+    router = bot.RpcRouter(["http://slow", "http://fast"])
+    slow, fast = router.endpoints
+    fast.latency = 0.01
+    slow.latency = 0.0
+    for endpoint in router.endpoints:
+        endpoint.latencies.extend([0.15] * 10)
+    # 第一个节点需要等待约0.3秒才能拿到令牌
+    slow.tokens = 0
+    slow.rate = 1 / 0.3
+    slow.refilled_at = time.monotonic()
+    
+    result = asyncio.run(router.request(PAYLOAD))
+    
+    assert result["result"] == "http://fast"
+    assert router.hedged == 1
+    (_, slow_sent), (_, fast_sent) = client.calls
+    assert fast_sent - slow_sent >= 0.15
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""TTLCache：相同key的并发请求共享一次上游调用"""
+
+import asyncio
+
+import fortytwo_telegram_bot as bot
+
+
+def test_cancelled_starter_does_not_cancel_waiters():
+    """发起上游请求的调用方被取消后，其他等待同一key的调用方仍能拿到结果并写入缓存"""
+    cache = bot.TTLCache(ttl=60, maxsize=10)
+    calls = []
+    
+    async def fetch_many(keys):
+        calls.append(list(keys))
+        await asyncio.sleep(0.05)
+        return {key: key * 2 for key in keys}
+    
+    async def scenario():
+        starter = asyncio.create_task(cache.get_many([1, 2], fetch_many))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_many([1], fetch_many))
+        await asyncio.sleep(0)
+        starter.cancel()
+        return await waiter
+    
+    assert asyncio.run(scenario()) == {1: 2}
+    assert calls == [[1, 2]]
+    assert cache.get(2) == 4
+
+
+def test_fetch_error_reaches_every_caller():
+    """上游请求失败时所有等待者都收到同一个异常，结果不缓存"""
+    cache = bot.TTLCache(ttl=60, maxsize=10)
+    
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+    
+    async def scenario():
+        return await asyncio.gather(
+            cache.get_or_fetch("key", fetch),
+            cache.get_or_fetch("key", fetch),
+            return_exceptions=True
+        )
+    
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get("key") is bot._MISSING
+    assert cache.coalesced == 1